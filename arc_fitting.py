@@ -0,0 +1,165 @@
+import math
+
+from gcode_optimizer import GcodeState, format_number, parse_line
+
+# Replaces runs of short G1 moves that lie on a circle (as CAM tools produce
+# when they flatten curves) with single G2/G3 arcs. Works as a generator on
+# the command stream, holding at most `max_points` moves back. With
+# numbered=True the stream is (number, command) pairs, e.g. file line numbers,
+# and every output command carries the number of the first input it replaces.
+
+
+class ArcFitStats:
+    def __init__(self):
+        self.lines_in = 0
+        self.lines_out = 0
+        self.arcs = 0
+
+    def describe(self):
+        return f"Arc fitting: {self.lines_in} -> {self.lines_out} commands ({self.arcs} arcs)"
+
+
+def circle_through(a, b, c):
+    # Centre and radius of the circle through three points, None if they are collinear
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < 1e-12:
+        return None
+    a2 = a[0] ** 2 + a[1] ** 2
+    b2 = b[0] ** 2 + b[1] ** 2
+    c2 = c[0] ** 2 + c[1] ** 2
+    cx = (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d
+    cy = (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d
+    return (cx, cy), math.hypot(a[0] - cx, a[1] - cy)
+
+
+def fit_arc(start, points, tolerance, max_radius):
+    # Returns (centre, clockwise) if start + points follow one arc within tolerance
+    fit = circle_through(start, points[len(points) // 2], points[-1])
+    if fit is None:
+        return None
+    (cx, cy), r = fit
+    if r > max_radius:
+        return None  # Practically straight; leave it to G1
+    sweep = 0.0
+    previous = start
+    previous_angle = math.atan2(start[1] - cy, start[0] - cx)
+    for point in points:
+        if abs(math.hypot(point[0] - cx, point[1] - cy) - r) > tolerance:
+            return None
+        # The original chord may not bulge away from the arc by more than the tolerance
+        half_chord = math.hypot(point[0] - previous[0], point[1] - previous[1]) / 2
+        if half_chord >= r or r - math.sqrt(r * r - half_chord * half_chord) > tolerance:
+            return None
+        angle = math.atan2(point[1] - cy, point[0] - cx)
+        step = (angle - previous_angle + math.pi) % (2 * math.pi) - math.pi
+        if step == 0 or (sweep and (step > 0) != (sweep > 0)):
+            return None  # Must keep turning the same way
+        sweep += step
+        previous, previous_angle = point, angle
+    if abs(sweep) >= 2 * math.pi - 1e-6:
+        return None
+    return (cx, cy), sweep < 0
+
+
+def fit_arcs(lines, tolerance=0.01, min_points=4, max_points=200, max_radius=5000.0, precision=3, stats=None,
+             numbered=False):
+    if stats is None:
+        stats = ArcFitStats()
+    state = GcodeState()
+    start = None  # Where the pending run of moves begins
+    run = []  # (point, command, words, number) of pending G1 moves
+    run_feed = None
+    fitted = None  # Arc fitted to the whole of `run`, if any
+    out_motion = None  # Motion mode the output leaves the controller in
+
+    def emit(command, words, motion, number):
+        # A move without a G word runs in the output's motion mode, which an
+        # emitted arc may have changed: put the input's mode back in front
+        nonlocal out_motion
+        stats.lines_out += 1
+        g_codes = [value for letter, value in words if letter == "G"]
+        if any(value in (0, 1, 2, 3) for value in g_codes):
+            out_motion = motion
+        elif (not g_codes and motion is not None and out_motion is not None and motion != out_motion
+              and any(letter in ("X", "Y", "Z") for letter, _ in words)):
+            command = f"G{motion} {command}"
+            out_motion = motion
+        return (number, command) if numbered else command
+
+    def arc_command(end, arc, feed, number):
+        nonlocal out_motion
+        (cx, cy), clockwise = arc
+        stats.arcs += 1
+        stats.lines_out += 1
+        out_motion = 2 if clockwise else 3
+        words = [f"G{out_motion}",
+                 f"X{format_number(end[0], precision)}", f"Y{format_number(end[1], precision)}",
+                 f"I{format_number(cx - start[0], precision)}", f"J{format_number(cy - start[1], precision)}"]
+        if feed is not None:
+            words.append(f"F{format_number(feed, precision)}")
+        command = " ".join(words)
+        return (number, command) if numbered else command
+
+    def flush():
+        # Emit everything pending, as one arc when the whole run fits
+        nonlocal start, run, fitted
+        out = []
+        if fitted is not None:
+            out.append(arc_command(run[-1][0], fitted, run_feed, run[0][3]))
+        else:
+            out.extend(emit(command, words, 1, number) for _, command, words, number in run)
+        if run:
+            start = run[-1][0]
+        run = []
+        fitted = None
+        return out
+
+    for item in lines:
+        number, line = item if numbered else (None, item)
+        code, words = parse_line(line)
+        if not code:
+            continue
+        stats.lines_in += 1
+        letters = {letter for letter, _ in words}
+        g_codes = [value for letter, value in words if letter == "G"]
+        is_g1 = g_codes == [1] or (not g_codes and state.motion == 1 and letters & {"X", "Y"})
+        feed = next((value for letter, value in words if letter == "F"), state.feed)
+        eligible = (is_g1 and letters <= {"G", "X", "Y", "F"} and letters & {"X", "Y"}
+                    and state.absolute is not False
+                    and state.position["X"] is not None and state.position["Y"] is not None)
+
+        if not eligible or (run and feed != run_feed):
+            yield from flush()
+        if not eligible:
+            state.update(words)
+            start = None
+            yield emit(code, words, state.motion, number)
+            continue
+
+        if not run:
+            start = (state.position["X"], state.position["Y"])
+            run_feed = feed
+        state.update(words)
+        run.append(((state.position["X"], state.position["Y"]), code, words, number))
+        if len(run) < min_points:
+            continue
+        arc = fit_arc(start, [entry[0] for entry in run], tolerance, max_radius)
+        if arc is not None and len(run) < max_points:
+            fitted = arc
+            continue
+        if arc is not None:
+            fitted = arc  # Long enough; close this arc and start a new run
+            yield from flush()
+            continue
+        # The newest move broke the run: close what fitted so far
+        if fitted is not None:
+            last = run.pop()
+            yield from flush()
+            run = [last]
+        else:
+            # Nothing fits yet; give up on the oldest move and keep trying
+            point, command, words, number = run.pop(0)
+            yield emit(command, words, 1, number)
+            start = point
+
+    yield from flush()
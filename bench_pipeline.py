@@ -0,0 +1,259 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import geometry
+from arc_fitting import fit_arcs
+from connection import SerialConnection
+from gcode_export import export_gcode, paths_to_gcode
+from gcode_optimizer import optimize_gcode
+from gcode_sender import GcodeStreamer
+from geometry import GeometryStore, segment_pairs, transform_circles, transform_coords
+from laser_sim import SimulatedController
+from path_optimizer import chain_segments, circle_path, order_paths
+
+# Throughput benchmark for the design -> G-code -> controller pipeline. Builds
+# synthetic designs of the given sizes (the same design for the same size and
+# seed), times each stage of the export behind Engrave / Save G-code, then
+# streams the result to the simulated controller (laser_sim.py). Results are
+# printed and saved as JSON; --baseline compares against an earlier run.
+#
+#   python bench_pipeline.py                       # 1k, 10k, 100k and 1M segments
+#   python bench_pipeline.py --sizes 1k 10k -o before.json
+#   python bench_pipeline.py --sizes 1k 10k --baseline before.json
+#
+# Streaming times are simulated seconds (wall time x --time-scale).
+
+DEFAULT_SIZES = ["1k", "10k", "100k", "1M"]
+CANVAS_WIDTH = 800  # px; shapes stay on a bed this size
+MACHINE_HEIGHT = 860
+MIB = 1024 * 1024
+MIN_REGRESSION = 0.005  # s; smaller slowdowns are timer noise
+
+
+def parse_size(text):
+    # "1k" -> 1000, "1M" -> 1000000
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text.rstrip("kKmM")) * scale)
+
+
+def make_design(segments, seed=1):
+    # Mostly wandering polylines of short segments (hatching, traced outlines),
+    # a quarter flattened arcs (for arc fitting) and the odd true circle. Each
+    # shape starts near the last one, like detailed artwork, so streaming is
+    # limited by the cutting and not by long moves across the bed.
+    rng = random.Random(seed)
+    store = GeometryStore()
+    left = segments
+    margin = 25.0
+    x, y = CANVAS_WIDTH / 2, MACHINE_HEIGHT / 2
+    while left > 0:
+        kind = rng.random()
+        x = min(max(x + rng.uniform(-5, 5), margin), CANVAS_WIDTH - margin)
+        y = min(max(y + rng.uniform(-5, 5), margin), MACHINE_HEIGHT - margin)
+        if kind < 0.05:
+            store.add_circle(x, y, rng.uniform(2, 20))
+            continue
+        shape = store.begin_shape("polyline")
+        if kind < 0.3:
+            r = rng.uniform(2, 20)
+            cx, cy = x, y
+            start, sweep = rng.uniform(0, 2 * math.pi), rng.uniform(math.pi / 2, 2 * math.pi)
+            count = min(left, max(4, int(r * sweep / 0.3)))
+            points = [(cx + r * math.cos(start + sweep * k / count), cy + r * math.sin(start + sweep * k / count))
+                      for k in range(count + 1)]
+        else:
+            count = min(left, rng.randint(20, 200))
+            heading = rng.uniform(0, 2 * math.pi)
+            points = [(x, y)]
+            for _ in range(count):
+                heading += rng.gauss(0, 0.3)
+                step = rng.uniform(0.05, 0.5)
+                x = min(max(x + step * math.cos(heading), 0.0), CANVAS_WIDTH)
+                y = min(max(y + step * math.sin(heading), 0.0), MACHINE_HEIGHT)
+                points.append((x, y))
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            store.add_segment(x1, y1, x2, y2, shape)
+        left -= count
+    return store
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline prints its own summaries; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(function, runs=1, memory=True):
+    # Returns (result, median seconds, peak MiB allocated while running).
+    # Memory is traced in a separate run, tracing slows Python down a lot.
+    times = []
+    for _ in range(runs):
+        with quiet():
+            started = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - started)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        with quiet():
+            function()
+        peak = tracemalloc.get_traced_memory()[1] / MIB
+        tracemalloc.stop()
+    return result, statistics.median(times), peak
+
+
+def bench_export(store, args):
+    # Each stage of export_gcode on its own, then the whole path end to end.
+    # Peak memory is only traced end to end; tracing every stage takes an age at 1M.
+    results = {}
+
+    def record(name, function, items, memory=False):
+        result, seconds, peak = timed(function, args.runs, memory)
+        stage = results[name] = {"seconds": seconds, "items": items, "items_per_s": items / max(seconds, 1e-9),
+                                 "peak_mib": peak}
+        memory = "" if peak is None else f", peak {peak:.1f} MiB"
+        print(f"  {name:9} {seconds * 1000:9.1f} ms  {stage['items_per_s']:12.0f} items/s{memory}", flush=True)
+        return result
+
+    centre = store.centre()
+    segments = record("extract", lambda: segment_pairs(transform_coords(store.coords, MACHINE_HEIGHT, centre=centre)),
+                      len(store))
+    circles = transform_circles(store.circles(), MACHINE_HEIGHT, centre=centre)
+    chained = record("chain", lambda: chain_segments(segments), len(segments))
+    curves = [circle_path(cx, cy, r) for cx, cy, r in circles]
+    paths, _ = record("order", lambda: order_paths(chained + curves, time_limit=args.order_time),
+                      len(chained) + len(curves))
+    lines = record("emit", lambda: paths_to_gcode(paths, args.speed, args.power), len(paths))
+    record("optimize", lambda: list(optimize_gcode(lines)), len(lines))
+    record("arc_fit", lambda: list(fit_arcs(lines)), len(lines))
+    record("export", lambda: export_gcode(store, MACHINE_HEIGHT, args.speed, args.power, time_limit=args.order_time),
+           len(store), not args.no_memory)
+    return results, paths
+
+
+def bench_stream(lines, firmware, baudrate, args):
+    # Streams through the same connection, reader thread and streamer as the GUI
+    controller = SimulatedController(firmware, baudrate, planner_depth=args.planner, time_scale=args.time_scale)
+    connection = SerialConnection("simulator", baudrate, open_port=lambda port, baudrate: controller)
+    with quiet():
+        connection.connect()
+        serial_port = connection.wait()
+    try:
+        streamer = GcodeStreamer(serial_port, firmware, reader=connection.reader)
+        # The move from the origin to the first cut would swamp short runs; it is made before the clock starts
+        first_cut = next((k for k, line in enumerate(lines) if line.startswith("M3")), 0)
+        with quiet():
+            streamer.stream(lines[:first_cut])
+        controller.wait_idle(timeout=120)
+        controller.reset_stats()
+        streamer.lines_sent = streamer.bytes_sent = 0
+        started = controller.clock()
+        with quiet():
+            streamer.stream(lines[first_cut:])
+        streamed = max(controller.clock() - started, 1e-9)
+        controller.wait_idle(timeout=60)
+        finished = controller.clock() - started
+    finally:
+        connection.close()
+    stats = controller.stats
+    return {"firmware": firmware, "baud": baudrate, "lines": streamer.lines_sent, "bytes": streamer.bytes_sent,
+            "seconds": streamed, "job_seconds": finished, "lines_per_s": streamer.lines_sent / streamed,
+            "bytes_per_s": streamer.bytes_sent / streamed, "starvation_events": stats["starvation_events"],
+            "starved_seconds": stats["starved_time"], "overflows": stats["overflows"], "errors": len(streamer.errors)}
+
+
+def compare(results, baseline, threshold):
+    # Prints every stage that got slower by more than `threshold`; returns how many did.
+    # Streaming runs are compared by rate, so they hold up when --stream-lines changes.
+    old = {}
+    for entry in baseline["results"]:
+        for name, stage in entry["stages"].items():
+            old[(entry["segments"], name)] = stage["seconds"]
+        for run in entry["streaming"]:
+            old[(entry["segments"], f"stream {run['firmware']} {run['baud']}")] = run["lines_per_s"]
+    regressions = 0
+    for entry in results:
+        checks = [(name, stage["seconds"], old.get((entry["segments"], name)))
+                  for name, stage in entry["stages"].items()]
+        for run in entry["streaming"]:
+            rate = old.get((entry["segments"], f"stream {run['firmware']} {run['baud']}"))
+            checks.append((f"stream {run['firmware']} {run['baud']}", run["seconds"],
+                           run["lines"] / rate if rate else None))
+        for name, seconds, before in checks:
+            if not before:
+                continue
+            change = seconds / before - 1
+            if change > threshold and seconds - before > MIN_REGRESSION:
+                regressions += 1
+                print(f"REGRESSION {entry['segments']} segments, {name}: {before:.3f}s -> {seconds:.3f}s "
+                      f"({change * 100:+.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark G-code generation and streaming on synthetic designs.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Design sizes in segments, e.g. 1k 50k 1M")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-n", "--runs", type=int, default=3, help="Timed runs per stage (median is reported)")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory run")
+    parser.add_argument("--speed", type=float, default=6000, help="Cutting feed rate (mm/min)")
+    parser.add_argument("--power", type=float, default=1000)
+    parser.add_argument("--order-time", type=float, default=1.0, help="Seconds spent improving the cut order")
+    parser.add_argument("--firmware", nargs="+", choices=("marlin", "grbl"), default=["marlin", "grbl"])
+    parser.add_argument("--baud", nargs="+", type=int, default=[115200, 250000])
+    parser.add_argument("--stream-lines", type=int, default=2000, help="Lines streamed per run (0: no streaming)")
+    parser.add_argument("--planner", type=int, default=16, help="Simulated planner depth")
+    parser.add_argument("--time-scale", type=float, default=4.0, help="Run the simulated controller this much faster")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown reported as a regression (0.1: 10%%)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in map(parse_size, args.sizes):
+        store = make_design(size, args.seed)
+        print(f"{size} segments, {len(store.circles())} circles", flush=True)
+        stages, paths = bench_export(store, args)
+
+        streaming = []
+        if args.stream_lines:
+            for firmware in args.firmware:
+                lines = list(optimize_gcode(paths_to_gcode(paths, args.speed, args.power,
+                                                           modal_motion=firmware == "grbl")))[:args.stream_lines]
+                for baudrate in args.baud:
+                    run = bench_stream(lines, firmware, baudrate, args)
+                    streaming.append(run)
+                    print(f"  stream {firmware:6} {baudrate:6}: {run['lines_per_s']:6.0f} lines/s "
+                          f"{run['bytes_per_s']:7.0f} bytes/s, {run['starvation_events']} starvation events "
+                          f"({run['starved_seconds']:.2f}s starved), {run['overflows']} overflows")
+        results.append({"segments": size, "stages": stages, "streaming": streaming})
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "numpy": geometry.np is not None,
+              "settings": vars(args), "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{regressions} regressions against {args.baseline}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold start benchmark for the two tools: launches each one in a fresh
+# interpreter, times how long until the window has been drawn, and closes it.
+#
+#   python bench_startup.py            # both tools, 5 runs each
+#   python bench_startup.py draw.py -n 10
+#   python bench_startup.py --in-process   # draw window opened from the controller
+
+# Runs in the child: mainloop() draws the window once, reports and exits
+CHILD = """
+import time
+started = time.perf_counter()
+import runpy, sys, tkinter
+
+def mainloop(self, n=0):
+    self.update()
+    print(f"READY {time.perf_counter() - started:.4f}", flush=True)
+    self.destroy()
+
+tkinter.Misc.mainloop = mainloop
+sys.argv = [sys.argv[1]]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+# Runs in the child: starts the controller, then times the Draw Cut button
+IN_PROCESS = """
+import time, tkinter
+import draw, lasersaw_1
+
+root = tkinter.Tk()
+app = lasersaw_1.CNCControlApp(root)
+root.update()
+started = time.perf_counter()
+app.open_draw_app()
+draw.root.update()
+print(f"READY {time.perf_counter() - started:.4f}", flush=True)
+root.destroy()
+"""
+
+
+def measure(script, timeout=60, child=CHILD):
+    # Returns (seconds from process launch to window drawn, seconds of that
+    # spent inside the script) or raises RuntimeError
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", child, script], capture_output=True, text=True, timeout=timeout)
+    total = time.perf_counter() - started
+    for line in result.stdout.splitlines():
+        if line.startswith("READY "):
+            return total, float(line.split()[1])
+    raise RuntimeError(f"{script} did not open a window:\n{result.stderr.strip()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start time of the GUI tools.")
+    parser.add_argument("scripts", nargs="*", default=["lasersaw_1.py", "draw.py"])
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--in-process", action="store_true", help="Also time opening the draw window from the controller")
+    args = parser.parse_args(argv)
+
+    for script in args.scripts:
+        totals, inside = [], []
+        for _ in range(args.runs):
+            total, ready = measure(script)
+            totals.append(total)
+            inside.append(ready)
+        print(f"{script}: window ready in {statistics.median(totals) * 1000:.0f} ms median "
+              f"(min {min(totals) * 1000:.0f} ms, {statistics.median(inside) * 1000:.0f} ms after "
+              f"interpreter start, {args.runs} runs)")
+
+    if args.in_process:
+        inside = [measure("draw.py", child=IN_PROCESS)[1] for _ in range(args.runs)]
+        print(f"draw window from the controller: {statistics.median(inside) * 1000:.1f} ms median "
+              f"(min {min(inside) * 1000:.1f} ms, {args.runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import queue
+import threading
+import time
+
+from serial_reader import SerialReader
+
+# Serial settings shared by the controller and the draw tool
+DEFAULT_PORT = os.environ.get("LASER_PORT", "COM3")  # e.g. the pty printed by laser_sim.py
+DEFAULT_BAUDRATE = 115200
+CONNECT_TIMEOUT = 5.0  # Seconds to wait for the port to open before a job gives up
+
+
+class SerialConnection:
+    # Opens the serial port on a background thread so the windows come up at
+    # once, whether or not the laser is switched on. connect() starts an
+    # attempt; wait() hands the open port to whoever needs it (the sender
+    # thread, before its first line) and retries after a failure.
+    def __init__(self, port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE, connect_timeout=CONNECT_TIMEOUT, open_port=None):
+        self.port = port
+        self.open_port = open_port  # open_port(port, baudrate) -> port object, in place of pyserial
+        self.baudrate = baudrate
+        self.connect_timeout = connect_timeout
+        self.serial_port = None
+        self.reader = None  # Thread reading everything the controller sends
+        self.events = queue.Queue()  # Position reports, errors and alarms for the UI (serial_reader.Reply)
+        self.state = "disconnected"  # disconnected, connecting, connected or failed
+        self.error = None
+        self.opened = threading.Event()  # Set whenever an attempt has finished
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # Start opening the port unless that is already done or under way
+        with self.lock:
+            if self.state in ("connecting", "connected"):
+                return
+            self.state = "connecting"
+            self.error = None
+            self.opened.clear()
+        threading.Thread(target=self.open, name="serial-connect", daemon=True).start()
+
+    def open(self):
+        try:
+            if self.open_port is not None:
+                serial_port = self.open_port(self.port, self.baudrate)
+            else:
+                import serial  # pyserial takes a while to import; keep it off the startup path
+                serial_port = serial.Serial(self.port, self.baudrate, timeout=1)
+        except Exception as e:
+            with self.lock:
+                self.state = "failed"
+                self.error = e
+            print(f"Could not open {self.port}: {e}")
+        else:
+            with self.lock:
+                self.serial_port = serial_port
+                self.reader = SerialReader(serial_port, self.events)
+                self.reader.start()
+                self.state = "connected"
+            print(f"Serial port opened on {self.port} with baud rate {self.baudrate}.")
+        self.opened.set()
+
+    def wait(self, abort_event=None):
+        # Returns the open port, connecting on demand. Raises ConnectionError
+        # if the port cannot be opened within connect_timeout or abort_event is set.
+        self.connect()
+        deadline = time.monotonic() + self.connect_timeout
+        while not self.opened.wait(0.05):
+            if abort_event is not None and abort_event.is_set():
+                raise ConnectionError(f"Connecting to {self.port} was aborted")
+            if time.monotonic() > deadline:
+                raise ConnectionError(f"No connection to {self.port} after {self.connect_timeout:g}s")
+        if self.state != "connected":
+            raise ConnectionError(f"Could not open {self.port}: {self.error}")
+        return self.serial_port
+
+    def write_realtime(self, data):
+        # GRBL real-time commands (?, !, ~, 0x18) skip the line queue and the
+        # RX buffer accounting; GRBL picks them out of the stream wherever they land.
+        # Returns False when there is no open port to write to.
+        serial_port = self.serial_port
+        if serial_port is None:
+            return False
+        serial_port.write(data)
+        return True
+
+    def close(self):
+        with self.lock:
+            serial_port, self.serial_port = self.serial_port, None
+            if self.state == "connected":
+                self.state = "disconnected"
+        if serial_port is not None:
+            serial_port.close()
+
+    def describe(self):
+        if self.state == "connected":
+            return f"Connected ({self.port})"
+        if self.state == "connecting":
+            return f"Connecting to {self.port}..."
+        if self.state == "failed":
+            return f"Not connected ({self.port}: {self.error})"
+        return "Disconnected"
@@ -1,52 +1,132 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, filedialog
-import serial  # Import the serial module
+from connection import SerialConnection
+from gcode_sender import SenderThread, start_job, poll_events
+from port_broker import connect_broker
+from path_optimizer import describe_travel
+from gcode_export import export_gcode
+from gcode_optimizer import optimize_gcode, OptimizerStats
+from gcode_file import read_gcode, sampled_progress
+from arc_fitting import fit_arcs, ArcFitStats
+from geometry import GeometryStore, draw_segment, draw_circle, redraw, save_design, load_design
 
 # Declare global variables
 canvas = None
-serial_port = None
-def setup_serial():
-    global serial_port
-    serial_port = serial.Serial('COM3', 115200, timeout=1)
-    print("Serial port opened on COM3 with baud rate 115200.")
-setup_serial()  # Call the setup_serial function to initialize the serial port
+design = GeometryStore()  # The drawing itself; the canvas only shows it
+connection = None  # Serial port, opened in the background once the window is up
+machine_width = None  # tk.IntVar, created in main()
+machine_height = None
+root = None
+sender = None  # Background thread that streams jobs to the port
+status_label = None
+connection_label = None
+firmware = "marlin"  # Controller firmware: "marlin" (ok-counting) or "grbl" (character-counting)
+gcode_precision = 3  # Decimal places written for coordinates and feed rates
+use_arcs = True  # Cut circles as G2 arcs; otherwise they are split into chords
+tessellation_tolerance = 0.01  # mm a chord may stray from the true curve
+fit_loaded_arcs = False  # Replace chord runs in loaded files with G2/G3 (needs arc support in the firmware)
+arc_tolerance = 0.01  # mm the arcs may deviate from the original moves
+# Canvas to machine transform applied on export: calibration (mm per canvas pixel),
+# rotation in degrees and mirroring about the design centre, then an offset in mm
+export_transform = {"mm_per_px": 1.0, "rotation": 0.0, "mirror_x": False, "mirror_y": False,
+                    "offset_x": 0.0, "offset_y": 0.0}
 def send_lines_to_engraver():
-    global canvas
-    lines = canvas.find_withtag("line")  # Get all items tagged with 'line'
+    global design
     gcode_commands = []
-    for line in lines:
-        x1, y1, x2, y2 = canvas.coords(line)  # Get coordinates of each line
+    for (x1, y1), (x2, y2) in design.segments():
         gcode_commands.append(f"G1 X{x1} Y{y1} S100")  # Assuming laser power is set to 100 (adjust as needed)
         gcode_commands.append(f"G1 X{x2} Y{y2} S0")    # Turn off laser at the end of the line
     send_command(gcode_commands)
-def send_command(gcode_commands):
-    global serial_port
-    for command in gcode_commands:
-        serial_port.write((command + "\n").encode())
-        serial_port.flush()
+def send_command(gcode_commands, name="Commands", on_done=None):
+    global root, sender
+    # Queue the commands on the sender thread; returns at once so the UI stays responsive.
+    # Refused (None) while another job runs, so the two never get mixed up.
+    if sender.busy():
+        messagebox.showwarning("Busy", f"{name}: wait for the running job to finish, or abort it.")
+        return None
+    return start_job(root, sender, gcode_commands, name=name,
+                     on_done=on_done or job_finished, on_progress=show_progress)
+
+def window_open():
+    # Jobs keep running after the draw window inside the controller is closed
+    return root is not None and root.winfo_exists()
+
+def show_progress(job):
+    if window_open():
+        status_label.config(text=f"{job.name}: {job.sent} lines sent")
+
+def job_finished(job):
+    elapsed = job.finished - job.started
+    if window_open():
+        status_label.config(text=f"{job.name} {job.state}: {job.sent} lines in {elapsed:.1f}s")
+    if job.state == "failed":
+        messagebox.showerror("Error", f"{job.name} failed: {job.error}")
+
+def show_connection():
+    if window_open():
+        connection_label.config(text=connection.describe())
+        root.after(250, show_connection)
+
+def abort_job():
+    global sender
+    sender.abort()
+    send_command(["M5"], name="Abort")  # Make sure the laser ends up off
+def export_design(speed, power, travel_speed):
+    global design, machine_height
+    # Same pipeline as the command line tool: transform, chain, order, emit, optimize
+    gcode_lines, stats, optimizer_stats = export_gcode(
+        design, machine_height.get(), speed, power, travel_speed,
+        precision=gcode_precision, modal_motion=firmware == "grbl", transform=export_transform,
+        use_arcs=use_arcs, tolerance=tessellation_tolerance)
+    return gcode_lines, stats
+
 def save_gcode():
-    global canvas
-    lines = canvas.find_withtag("line")
-   
-    machine_height = 860  # Assuming the machine's height is 860mm, adjust as needed
-    gcode_lines = []
-    for line in lines:
-        x1, y1, x2, y2 = canvas.coords(line)
-        # Adjust coordinates to match desired position relative to bottom-left corner
-        # Subtract x-coordinate from machine width and y-coordinate from machine height
-        # to move the origin to the bottom-left corner
-        y1 = machine_height - y1
-        y2 = machine_height - y2
-        # Add feedrate (speed) and laser power (S100 for on, S0 for off)
-        gcode_lines.append(f"G1 X{x1} Y{y1} F3000 S1000")  # Turn laser on
-        gcode_lines.append(f"G1 X{x2} Y{y2} F2000 S0")    # Turn laser off
+    # Cut at F2000, travel at F3000, laser power S1000
+    gcode_lines, stats = export_design(speed=2000, power=1000, travel_speed=3000)
     file_path = filedialog.asksaveasfilename(defaultextension=".gcode",
                                               filetypes=[("G-code Files", "*.gcode")])
     if file_path:
         with open(file_path, 'w') as f:
             f.write("\n".join(gcode_lines))
-        messagebox.showinfo("G-code Export", "G-code saved successfully.")
+        messagebox.showinfo("G-code Export", f"G-code saved successfully.\n{describe_travel(stats)}")
+
+def save_design_file():
+    file_path = filedialog.asksaveasfilename(defaultextension=".json",
+                                              filetypes=[("Design Files", "*.json")])
+    if file_path:
+        save_design(design, file_path)
+
+def open_design_file():
+    global design
+    file_path = filedialog.askopenfilename(filetypes=[("Design Files", "*.json"), ("Line Files", "*.txt")])
+    if file_path:
+        design = load_design(file_path)
+        redraw(canvas, design)
+
+def Engrave():
+    global speed_entry, power_entry
+
+    # Get the values from the speed and power entries
+    try:
+        speed = int(speed_entry.get())
+        power = int(power_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Please enter valid integer speed and power values.")
+        return
+
+    # Define the traveling speed when the laser is off
+    travel_speed = 2000
+
+    gcode_lines, stats = export_design(speed, power, travel_speed)
+
+    def engraving_finished(job):
+        job_finished(job)
+        if job.state == "done":
+            messagebox.showinfo("Engraving", f"G-code sent to the laser engraver.\n{describe_travel(stats)}")
+
+    # Stream the G-code in the background; the Abort button stays live meanwhile
+    send_command(gcode_lines, name="Engrave", on_done=engraving_finished)
 
 
 
@@ -57,40 +137,75 @@ def save_gcode():
 
 
 def cut():
-    global serial_port
     file_path = filedialog.askopenfilename(filetypes=[("G-code Files", "*.gcode")])
     if file_path:
         print("Reading G-code file:", file_path)
-        with open(file_path, 'r') as f:
-            gcode_commands = f.readlines()
-            print("Sending G-code commands:")
-            for command in gcode_commands:
-                print(command.strip())
-            send_command([command.strip() for command in gcode_commands])  # Sending each command individually
+        # The file is read lazily while the sender thread streams it, so memory
+        # use stays flat; zero-length moves and redundant laser toggles are dropped
+        stats = OptimizerStats()
+        gcode_commands = optimize_gcode(read_gcode(file_path), stats)
+        arc_stats = ArcFitStats()
+        if fit_loaded_arcs:
+            gcode_commands = fit_arcs(gcode_commands, tolerance=arc_tolerance, stats=arc_stats)
+        gcode_commands = sampled_progress(gcode_commands, label="Queued")
+
+        def cut_finished(job):
+            print(stats.describe())
+            if fit_loaded_arcs:
+                print(arc_stats.describe())
+            job_finished(job)
+
+        send_command(gcode_commands, name="Cut", on_done=cut_finished)  # Streamed by the sender thread
 
 def home_laser():
-    global serial_port
     print("Sending homing command...")
     # Send homing command along with the current position as 0,0
     send_command(["G28 F2000 "])  
     print("Homing command sent.")
 
-def main():
-    global canvas, serial_port
-
+def open_window(master=None, shared_sender=None, shared_connection=None, settings=None):
+    # Builds the draw window: standalone as the Tk root, or as a Toplevel of
+    # `master` inside the controller, using its sender thread, connection and
+    # settings (firmware, power). Only one draw window exists at a time.
+    global canvas, connection, root, sender, status_label, connection_label, machine_width, machine_height, firmware
 
+    if window_open():
+        root.lift()
+        return root
 
-    root = tk.Tk()
+    if master is None:
+        root = tk.Tk()
+    else:
+        root = tk.Toplevel(master)
     root.title("Draw Cut Application")
     root.geometry("1600x1200")  # Adjusted window size for better layout
+    settings = settings or {}
+    firmware = settings.get("firmware", firmware)
+
+    if shared_sender is not None:
+        # The controller's sender thread; its poll_events delivers our job events too
+        sender, connection = shared_sender, shared_connection
+    else:
+        # Start the sender thread and deliver its results back on the Tk thread.
+        # When the controller is running it owns the port and our jobs go through
+        # it; otherwise the port is opened on demand, so the window does not wait
+        # for the laser.
+        sender = connect_broker()
+        if sender is not None:
+            connection = sender  # Shows the controller's connection state
+        else:
+            connection = SerialConnection()
+            sender = SenderThread(connection, firmware=firmware)
+        sender.start()
+        poll_events(root, sender)
 
     # Menu frame for inputs at the top of the window
     menu_frame = tk.Frame(root)
     menu_frame.pack(side='top', fill='x', expand=False)
 
     # Variables for machine and material dimensions with default values
-    machine_width = tk.IntVar(value=410)
-    machine_height = tk.IntVar(value=860)
+    machine_width = tk.IntVar(value=settings.get("machine_width", 410))
+    machine_height = tk.IntVar(value=settings.get("machine_height", 860))
 
     # Canvas setup; dimensions will be updated via a function
     canvas = tk.Canvas(root, bg='white')
@@ -103,9 +218,11 @@ def main():
         canvas.delete("all")  # Clear previous drawings
         # Draw the maximum cutting area
         canvas.create_rectangle(2.5, 2.5, mw - 2.5, mh - 2.5, outline="blue", width=1)
+        redraw(canvas, design)  # The design survives a machine size change
 
-    # Function to clear all lines from the canvas
+    # Function to clear all lines from the design and the canvas
     def clear_lines():
+        design.clear()
         canvas.delete("line")  # Assumes all lines are tagged with 'line' when created
 
     # Machine width and height entries
@@ -153,24 +270,71 @@ def main():
     # Button for homing
     home_button = ttk.Button(menu_frame, text="Home", command=home_laser)
     home_button.pack(side='left', padx=5)
+
+    engrave_button = ttk.Button(menu_frame, text="Engrave", command=Engrave)
+    engrave_button.pack(side='left', padx=5)
+
+    # Speed and power used by Engrave
+    global speed_entry, power_entry
+
+    speed_label = ttk.Label(menu_frame, text="Speed (F):")
+    speed_label.pack(side='left', padx=5)
+
+    speed_entry = ttk.Entry(menu_frame, width=7)
+    speed_entry.pack(side='left', padx=5)
+
+    power_label = ttk.Label(menu_frame, text="Power (S):")
+    power_label.pack(side='left', padx=5)
+
+    power_entry = ttk.Entry(menu_frame, width=7)
+    power_entry.pack(side='left', padx=5)
+    if "power" in settings:
+        power_entry.insert(0, str(settings["power"]))
+
+    # Abort stops the running job without waiting for the queue to drain
+    abort_button = ttk.Button(menu_frame, text="Abort", command=abort_job)
+    abort_button.pack(side='left', padx=5)
+
+    status_label = ttk.Label(menu_frame, text="Idle")
+    status_label.pack(side='left', padx=5)
+
+    connection_label = ttk.Label(menu_frame, text=connection.describe())
+    connection_label.pack(side='left', padx=5)
+
+    # Second menu frame for basic shapes
+    shape_menu_frame = tk.Frame(root)
+    shape_menu_frame.pack(side='top', fill='x', expand=False, before=canvas)
+
+    # Button to draw circles: press at the centre, drag out the radius
+    circle_button = ttk.Button(shape_menu_frame, text="Circle", command=lambda: create_circle())
+    circle_button.pack(side='left', padx=5)
+
+    # Designs can be saved for the command line tool (laser_cli.py) and opened again
+    save_design_button = ttk.Button(shape_menu_frame, text="Save Design", command=save_design_file)
+    save_design_button.pack(side='left', padx=5)
+    open_design_button = ttk.Button(shape_menu_frame, text="Open Design", command=open_design_file)
+    open_design_button.pack(side='left', padx=5)
     # Functions to handle drawing and material settings
     line_start = None
+    polyline = None  # Shape record the clicked segments are added to
     line_drawing_enabled = False  # To track if line drawing mode is enabled
 
     def handle_left_click(event):
-        nonlocal line_start
+        nonlocal line_start, polyline
         if line_drawing_enabled:
             if line_start is None:
                 line_start = (event.x, event.y)
+                polyline = design.begin_shape("polyline")
                 canvas.create_oval(event.x-2, event.y-2, event.x+2, event.y+2, fill="green")
             else:
-                # Tagging lines with 'line' for easy removal
-                canvas.create_line(line_start[0], line_start[1], event.x, event.y, fill="green", width=2, tags="line")
+                design.add_segment(line_start[0], line_start[1], event.x, event.y, polyline)
+                draw_segment(canvas, line_start[0], line_start[1], event.x, event.y)
                 line_start = (event.x, event.y)
 
     def handle_right_click(event):
-        nonlocal line_start
+        nonlocal line_start, polyline
         line_start = None
+        polyline = None
 
     def draw_material():
         canvas.delete("material_area")
@@ -193,19 +357,68 @@ def main():
             canvas.unbind("<Button-3>")
             draw_line_button.config(text="Enable Draw Line")
         else:
+            if circle_drawing_enabled:
+                create_circle()  # Both modes use the left mouse button
             canvas.bind("<Button-1>", handle_left_click)
             canvas.bind("<Button-3>", handle_right_click)
             draw_line_button.config(text="Disable Draw Line")
         line_drawing_enabled = not line_drawing_enabled
 
+    circle_centre = None
+    circle_drawing_enabled = False
+
+    def circle_radius(event):
+        return ((event.x - circle_centre[0]) ** 2 + (event.y - circle_centre[1]) ** 2) ** 0.5
+
+    def handle_circle_press(event):
+        nonlocal circle_centre
+        circle_centre = (event.x, event.y)
+
+    def handle_circle_drag(event):
+        if circle_centre is not None:
+            r = circle_radius(event)
+            canvas.delete("circle_preview")
+            canvas.create_oval(circle_centre[0] - r, circle_centre[1] - r, circle_centre[0] + r, circle_centre[1] + r,
+                               outline="grey", dash=(2, 2), tags="circle_preview")
+
+    def handle_circle_release(event):
+        nonlocal circle_centre
+        canvas.delete("circle_preview")
+        if circle_centre is not None:
+            r = circle_radius(event)
+            if r > 0:
+                design.add_circle(circle_centre[0], circle_centre[1], r)
+                draw_circle(canvas, circle_centre[0], circle_centre[1], r)
+            circle_centre = None
+
+    def create_circle():
+        nonlocal circle_drawing_enabled
+        if circle_drawing_enabled:
+            canvas.unbind("<ButtonPress-1>")
+            canvas.unbind("<B1-Motion>")
+            canvas.unbind("<ButtonRelease-1>")
+            circle_button.config(text="Circle")
+        else:
+            if line_drawing_enabled:
+                toggle_line_drawing()  # Both modes use the left mouse button
+            canvas.bind("<ButtonPress-1>", handle_circle_press)
+            canvas.bind("<B1-Motion>", handle_circle_drag)
+            canvas.bind("<ButtonRelease-1>", handle_circle_release)
+            circle_button.config(text="Stop Circles")
+        circle_drawing_enabled = not circle_drawing_enabled
+
 
 
     # Initialize the canvas with the default machine size
     update_canvas()
 
+    # Start opening the port now that the window is built
+    connection.connect()
+    show_connection()
+    return root
 
-
-
+def main():
+    open_window()
     root.mainloop()
 
 if __name__ == "__main__":
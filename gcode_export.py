@@ -0,0 +1,125 @@
+from geometry import transform_coords, transform_circles, segment_pairs
+from gcode_optimizer import format_number, optimize_gcode, OptimizerStats
+from path_optimizer import ArcPoint, chain_segments, circle_path, order_paths, describe_travel
+from tessellate import tessellate_circle
+
+# Turns ordered cut paths (lists of (x, y) machine coordinates) into G-code,
+# and runs the whole design -> G-code pipeline shared by Engrave, save_gcode
+# and the command line tool
+
+
+class GcodeEmitter:
+    # Tracks the controller's modal state and only writes the words that change.
+    # modal_motion leaves out repeated G0/G1 words; GRBL accepts that, Marlin does not.
+    def __init__(self, precision=3, modal_motion=False):
+        self.precision = precision
+        self.modal_motion = modal_motion
+        self.lines = []
+        self.x = None  # Last written coordinates, as text at the output precision
+        self.y = None
+        self.position = None  # Last position as numbers, for arc centre offsets
+        self.feed = None
+        self.motion = None
+        self.laser = None  # None (unknown), "M3" or "M5"
+        self.power = None
+
+    def move(self, x, y, feed, motion=1):
+        words = []
+        x_text = format_number(x, self.precision)
+        y_text = format_number(y, self.precision)
+        if x_text != self.x:
+            words.append(f"X{x_text}")
+        if y_text != self.y:
+            words.append(f"Y{y_text}")
+        if not words:
+            return  # Already there at the output precision
+        feed_text = format_number(feed, self.precision)
+        if feed_text != self.feed:
+            words.append(f"F{feed_text}")
+        if motion != self.motion or not self.modal_motion:
+            words.insert(0, f"G{motion}")
+        self.x, self.y, self.feed, self.motion = x_text, y_text, feed_text, motion
+        self.position = (x, y)
+        self.lines.append(" ".join(words))
+
+    def arc(self, x, y, cx, cy, clockwise, feed):
+        # G2/G3 to (x, y) around (cx, cy). I/J are relative to the start point; an
+        # arc that ends where it starts is a full circle. X and Y are always
+        # written: GRBL rejects an arc without axis words (error:26).
+        motion = 2 if clockwise else 3
+        x_text = format_number(x, self.precision)
+        y_text = format_number(y, self.precision)
+        words = [f"X{x_text}", f"Y{y_text}"]
+        start_x, start_y = self.position
+        words.append(f"I{format_number(cx - start_x, self.precision)}")
+        words.append(f"J{format_number(cy - start_y, self.precision)}")
+        feed_text = format_number(feed, self.precision)
+        if feed_text != self.feed:
+            words.append(f"F{feed_text}")
+        if motion != self.motion or not self.modal_motion:
+            words.insert(0, f"G{motion}")
+        self.x, self.y, self.feed, self.motion = x_text, y_text, feed_text, motion
+        self.position = (x, y)
+        self.lines.append(" ".join(words))
+
+    def laser_on(self, power):
+        power_text = format_number(power, self.precision)
+        if self.laser == "M3" and power_text == self.power:
+            return
+        self.lines.append(f"M3 S{power_text}")
+        self.laser, self.power = "M3", power_text
+
+    def laser_off(self):
+        if self.laser != "M5":
+            self.lines.append("M5")
+            self.laser = "M5"
+
+
+def paths_to_gcode(paths, speed, power, travel_speed=2000, precision=3, modal_motion=False):
+    emitter = GcodeEmitter(precision, modal_motion)
+    for path in paths:
+        # Move to starting position with the laser off
+        emitter.laser_off()
+        emitter.move(path[0][0], path[0][1], travel_speed)
+
+        # Turn laser on and cut the whole polyline in one go
+        emitter.laser_on(power)
+        feed = speed if power > 0 else travel_speed
+        for point in path[1:]:
+            if isinstance(point, ArcPoint):
+                emitter.arc(point.x, point.y, point.cx, point.cy, point.clockwise, feed)
+            else:
+                emitter.move(point[0], point[1], feed)
+    emitter.laser_off()
+    return emitter.lines
+
+
+def export_paths(design, machine_height, transform=None, use_arcs=True, tolerance=0.01, time_limit=1.0):
+    # Design (canvas pixels) -> ordered cut paths in machine millimetres
+    transform = transform or {}
+    centre = design.centre()
+    segments = segment_pairs(transform_coords(design.coords, machine_height, centre=centre, **transform))
+    circles = transform_circles(design.circles(), machine_height, centre=centre, **transform)
+    if use_arcs:
+        # Circles are cut as single G2 arcs instead of chains of short G1 moves
+        curves = [circle_path(cx, cy, r) for cx, cy, r in circles]
+    else:
+        # Otherwise as many chords as the tolerance (machine mm) needs
+        curves = [tessellate_circle(cx, cy, r, tolerance) for cx, cy, r in circles]
+    # Join connected segments into polylines, then pick a cut order that keeps
+    # laser-off travel short, starting from the machine origin
+    paths, stats = order_paths(chain_segments(segments) + curves, time_limit=time_limit)
+    stats["segments"] = len(segments)
+    print(f"{len(segments)} segments chained into {len(paths)} paths. {describe_travel(stats)}")
+    return paths, stats
+
+
+def export_gcode(design, machine_height, speed, power, travel_speed=2000, precision=3, modal_motion=False,
+                 transform=None, use_arcs=True, tolerance=0.01, time_limit=1.0):
+    # Returns the G-code lines, the travel statistics and the optimizer statistics
+    paths, stats = export_paths(design, machine_height, transform, use_arcs, tolerance, time_limit)
+    optimizer_stats = OptimizerStats()
+    gcode_lines = paths_to_gcode(paths, speed, power, travel_speed, precision, modal_motion)
+    gcode_lines = list(optimize_gcode(gcode_lines, optimizer_stats))
+    print(optimizer_stats.describe())
+    return gcode_lines, stats, optimizer_stats
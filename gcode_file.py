@@ -0,0 +1,201 @@
+import mmap
+import os
+import time
+from array import array
+from collections import deque
+
+from gcode_optimizer import AXES, GcodeState, format_number, parse_line, strip_comment
+
+# Every INDEX_STEP-th line start is remembered, so jumping to a line scans at
+# most that many lines. So is the modal state there, once a job or a resume
+# has read that far, so rebuilding it parses at most that many lines too.
+INDEX_STEP = 64
+
+# Reading G-code programs from disk without holding them in memory
+
+
+def read_gcode(file_path):
+    # Yields the commands of a G-code file one at a time, without comments or blank lines
+    with open(file_path, 'r', errors="replace") as f:
+        for line in f:
+            command = strip_comment(line)
+            if command:
+                yield command
+
+
+def sampled_progress(lines, label="Sent", interval=1.0):
+    # Passes lines through, printing a running count at most once per interval
+    count = 0
+    last_report = time.monotonic()
+    for line in lines:
+        count += 1
+        now = time.monotonic()
+        if now - last_report >= interval:
+            last_report = now
+            print(f"{label}: {count} lines")
+        yield line
+    print(f"{label}: {count} lines total")
+
+
+class GcodeIndex:
+    # Memory-mapped G-code file with a sparse index of line offsets, built on
+    # the fly while reading. Line numbers are 1-based, as in an editor.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = open(file_path, 'rb')
+        if os.fstat(self.file.fileno()).st_size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""  # mmap refuses empty files
+        self.checkpoints = array('Q', [0])  # Byte offset of lines 1, 1 + INDEX_STEP, ...
+        self.states = [GcodeState()]  # Modal state when the same lines start
+        self.total_lines = None  # Known once the end of the file has been reached
+        stat = os.fstat(self.file.fileno())
+        self.stamp = (stat.st_size, stat.st_mtime_ns)
+
+    def unchanged(self):
+        # False once the file on disk was rewritten; the index no longer fits it
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == self.stamp
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def scan(self, number):
+        # Yields (line number, start offset, end offset) from line `number` on
+        checkpoint = min((number - 1) // INDEX_STEP, len(self.checkpoints) - 1)
+        current = checkpoint * INDEX_STEP + 1
+        pos = self.checkpoints[checkpoint]
+        data = self.data
+        size = len(data)
+        while pos < size:
+            end = data.find(b"\n", pos)
+            end = size if end < 0 else end + 1
+            if (current - 1) % INDEX_STEP == 0 and (current - 1) // INDEX_STEP == len(self.checkpoints):
+                self.checkpoints.append(pos)
+            if current >= number:
+                yield current, pos, end
+            pos = end
+            current += 1
+        self.total_lines = current - 1
+
+    def line_count(self):
+        if self.total_lines is None:
+            start = (len(self.checkpoints) - 1) * INDEX_STEP + 1
+            for _ in self.scan(start):
+                pass
+        return self.total_lines
+
+    def line(self, number):
+        for _, start, end in self.scan(number):
+            return self.data[start:end].decode(errors="replace").rstrip("\r\n")
+        raise IndexError(f"Line {number} is past the end of {self.file_path}")
+
+    def commands_from(self, number=1):
+        # Yields (line number, command) without comments or blank lines
+        data = self.data
+        for current, start, end in self.scan(number):
+            command = strip_comment(data[start:end].decode(errors="replace"))
+            if command:
+                yield current, command
+
+    def tracked_commands(self, number, state):
+        # commands_from(number), keeping `state` (the modal state when line
+        # `number` starts) up to date and saving it at every checkpoint passed.
+        # Each command is applied after it has been yielded.
+        for current, command in self.commands_from(number):
+            while len(self.states) * INDEX_STEP < current:
+                self.states.append(state.copy())
+            yield current, command
+            state.update(parse_line(command)[1])
+
+    def state_known(self, number):
+        # True if state_before(number) is quick: a saved state is at most INDEX_STEP lines back
+        return (number - 1) // INDEX_STEP < len(self.states)
+
+    def state_before(self, number):
+        # Modal state the controller is in when line `number` starts, parsed on
+        # from the nearest saved state. From far into a new index this reads the
+        # whole file up to there; send_indexed_file does that off the Tk thread.
+        checkpoint = min((number - 1) // INDEX_STEP, len(self.states) - 1)
+        state = self.states[checkpoint].copy()
+        for current, _ in self.tracked_commands(checkpoint * INDEX_STEP + 1, state):
+            if current >= number:
+                break
+        return state
+
+    def resume_commands(self, number):
+        # Commands that restore the modal state at line `number`, followed by the
+        # rest of the file. Every command comes with the file line it belongs to.
+        state = self.state_before(number)
+        if number > 1:
+            for command in resume_preamble(state):
+                yield number, command
+        yield from self.tracked_commands(number, state)
+
+
+def resume_preamble(state):
+    # Laser off, travel back to the last known position, then restore units,
+    # feed rate, distance mode and laser state
+    commands = ["M5"]
+    if state.metric is not None:
+        commands.append("G21" if state.metric else "G20")
+    commands.append("G90")
+    position = [f"{axis}{format_number(state.position[axis])}" for axis in AXES
+                if state.position[axis] is not None]
+    if position:
+        commands.append("G0 " + " ".join(position))
+    if state.feed is not None:
+        commands.append(f"G1 F{format_number(state.feed)}")
+    if state.absolute is False:
+        commands.append("G91")
+    if state.laser in ("M3", "M4"):
+        if state.power is not None:
+            commands.append(f"{state.laser} S{format_number(state.power)}")
+        else:
+            commands.append(state.laser)
+    return commands
+
+
+class ResumeTracker:
+    # Remembers which file line each streamed command came from, so a stopped
+    # job can be resumed from the first line that may not have run yet
+    def __init__(self, numbered_commands, planner_depth=16):
+        self.numbered_commands = numbered_commands
+        self.planner_depth = planner_depth  # Acknowledged moves may still sit in the planner
+        self.current = 1
+        self.tags = deque()  # Source line of each command not yet known to be done
+        self.dropped = 0
+
+    def source(self):
+        # Plain commands for the optimizer, noting the line being read
+        for number, command in self.numbered_commands:
+            self.current = number
+            yield command
+
+    def number(self, commands):
+        # Pairs each optimizer output with the line that was being read when it
+        # came out (the optimizer holds back no moves, only the odd M5)
+        for command in commands:
+            yield self.current, command
+
+    def tag(self, numbered_commands):
+        # Remembers the source line of each command on its way to the controller.
+        # fit_arcs(numbered=True) goes in between: its arcs hold moves back, and
+        # carry the line of the first move they replace.
+        for number, command in numbered_commands:
+            self.tags.append(number)
+            yield command
+
+    def resume_line(self, acknowledged):
+        # First file line that may not have been executed after `acknowledged` commands
+        done = max(0, acknowledged - self.planner_depth)
+        while self.tags and self.dropped < done:
+            self.tags.popleft()
+            self.dropped += 1
+        return self.tags[0] if self.tags else self.current
@@ -0,0 +1,202 @@
+import re
+
+# Peephole optimizer for G-code programs. Works line by line as a generator so
+# it can sit between a file reader and the sender without buffering the job.
+#
+# - zero-length G0/G1 moves are dropped (a feed rate they carry is kept for
+#   the next real move)
+# - an M5 that is immediately followed by an M3/M4 at the same power is
+#   dropped together with it, as are M3/M5 that do not change the laser state
+# - G90/G91/G20/G21 that repeat the current mode are dropped
+
+WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+AXES = ("X", "Y", "Z")
+EPSILON = 1e-9
+
+
+def strip_comment(line):
+    line = line.split(";", 1)[0]
+    if "(" in line:
+        line = re.sub(r"\([^)]*\)", "", line)
+    return line.strip()
+
+
+def parse_line(line):
+    # Returns the cleaned command and its words as a list of (letter, value)
+    code = strip_comment(line).upper()
+    return code, [(letter, float(value)) for letter, value in WORD.findall(code)]
+
+
+def format_number(value, precision=6):
+    # Fixed precision without trailing zeros: 16.0 -> "16", 12.3456 -> "12.346" (precision 3)
+    text = f"{value:.{precision}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text == "-0":
+        text = "0"
+    return text
+
+
+class GcodeState:
+    # Modal state of the controller as implied by the commands seen so far.
+    # None means unknown (e.g. position after homing).
+    def __init__(self):
+        self.absolute = None
+        self.metric = None
+        self.motion = None
+        self.position = {axis: None for axis in AXES}
+        self.feed = None
+        self.power = None
+        self.laser = None  # "M3", "M4", "M5" or None
+
+    def copy(self):
+        state = GcodeState()
+        state.__dict__.update(self.__dict__)
+        state.position = dict(self.position)
+        return state
+
+    def target(self, words):
+        # Position after a move with the given words
+        target = dict(self.position)
+        for letter, value in words:
+            if letter in AXES:
+                if self.absolute is False:
+                    target[letter] = None if target[letter] is None else target[letter] + value
+                else:
+                    target[letter] = value
+        return target
+
+    def update(self, words):
+        g_codes = [value for letter, value in words if letter == "G"]
+        m_codes = [value for letter, value in words if letter == "M"]
+        has_axes = any(letter in AXES for letter, _ in words)
+        for g in g_codes:
+            if g in (0, 1, 2, 3):
+                self.motion = int(g)
+            elif g == 90:
+                self.absolute = True
+            elif g == 91:
+                self.absolute = False
+            elif g == 21:
+                self.metric = True
+            elif g == 20:
+                self.metric = False
+            elif g in (28, 92):
+                # Homing / setting the origin: the position is no longer known
+                self.position = {axis: None for axis in AXES}
+                has_axes = False
+        for letter, value in words:
+            if letter == "F":
+                self.feed = value
+            elif letter == "S":
+                self.power = value
+        for m in m_codes:
+            if m in (3, 4, 5):
+                self.laser = f"M{int(m)}"
+            elif m in (112, 410):
+                self.laser = "M5"
+        if has_axes and (self.motion is not None or g_codes):
+            self.position = self.target(words)
+
+
+class OptimizerStats:
+    def __init__(self):
+        self.lines_in = 0
+        self.lines_out = 0
+
+    def describe(self):
+        removed = self.lines_in - self.lines_out
+        return f"G-code optimizer: {self.lines_in} -> {self.lines_out} commands ({removed} removed)"
+
+
+def is_zero_length(state, words):
+    if state.absolute is False:
+        return all(abs(value) <= EPSILON for letter, value in words if letter in AXES)
+    target = state.target(words)
+    for axis in AXES:
+        if not any(letter == axis for letter, _ in words):
+            continue
+        if target[axis] is None or state.position[axis] is None:
+            return False
+        if abs(target[axis] - state.position[axis]) > EPSILON:
+            return False
+    return True
+
+
+def optimize_gcode(lines, stats=None):
+    if stats is None:
+        stats = OptimizerStats()
+    state = GcodeState()
+    sent_feed = None  # Feed rate the controller actually received
+    held_m5 = None  # M5 waiting to see whether the laser comes straight back on
+
+    def emit(code):
+        stats.lines_out += 1
+        return code
+
+    for line in lines:
+        code, words = parse_line(line)
+        if not code:
+            continue
+        stats.lines_in += 1
+        letters = [letter for letter, _ in words]
+        g_codes = [value for letter, value in words if letter == "G"]
+        m_codes = [value for letter, value in words if letter == "M"]
+        has_axes = any(letter in AXES for letter in letters)
+
+        motion = None
+        if not m_codes:
+            if len(g_codes) == 1 and g_codes[0] in (0, 1):
+                motion = g_codes[0]
+            elif not g_codes and has_axes and state.motion in (0, 1):
+                motion = state.motion  # Modal move such as "X10 Y5"
+
+        if motion is not None and has_axes and "S" not in letters:
+            if is_zero_length(state, words):
+                # Nothing moves; only remember the modal words it sets
+                state.update(words)
+                continue
+            if held_m5 is not None:
+                yield emit(held_m5[0])
+                held_m5 = None
+            if "F" not in letters and state.feed is not None and sent_feed != state.feed:
+                code += f" F{format_number(state.feed)}"
+            state.update(words)
+            sent_feed = state.feed
+            yield emit(code)
+            continue
+
+        if len(words) == 1 and g_codes and g_codes[0] in (20, 21, 90, 91):
+            g = g_codes[0]
+            if (g == 90 and state.absolute is True) or (g == 91 and state.absolute is False) \
+                    or (g == 21 and state.metric is True) or (g == 20 and state.metric is False):
+                continue
+
+        if len(m_codes) == 1 and not g_codes and m_codes[0] in (3, 4):
+            laser = f"M{int(m_codes[0])}"
+            power = next((value for letter, value in words if letter == "S"), state.power)
+            if held_m5 is not None and state.laser == "M5" and held_m5[1] == (laser, power):
+                # M5 straight followed by the same M3: the laser never needed to go off
+                state.laser = laser
+                held_m5 = None
+                continue
+            if held_m5 is None and state.laser == laser and state.power == power:
+                continue
+
+        if len(m_codes) == 1 and not g_codes and m_codes[0] == 5 and len(words) == 1:
+            if held_m5 is not None or state.laser == "M5":
+                continue
+            held_m5 = (code, (state.laser, state.power))
+            state.update(words)
+            continue
+
+        if held_m5 is not None:
+            yield emit(held_m5[0])
+            held_m5 = None
+        state.update(words)
+        if "F" in letters:
+            sent_feed = state.feed
+        yield emit(code)
+
+    if held_m5 is not None:
+        yield emit(held_m5[0])
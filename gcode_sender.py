@@ -0,0 +1,422 @@
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+from serial_reader import classify
+
+# Size of the controller's serial receive buffer.
+# GRBL counts characters (128 byte RX buffer on the stock Uno build),
+# Marlin counts whole commands (BUFSIZE in Configuration_adv.h, default 4).
+GRBL_RX_BUFFER_SIZE = 128
+MARLIN_BUFSIZE = 4
+
+LASER_CODE = re.compile(r"M0*([345])(?![\d.])")
+
+
+class StreamError(Exception):
+    pass
+
+
+class StreamAborted(StreamError):
+    pass
+
+
+def clean_command(command):
+    # Drop comments and surrounding whitespace so only real commands are counted
+    command = command.split(";", 1)[0]
+    return command.strip()
+
+
+class GcodeStreamer:
+    # Replies come from `reader` (a serial_reader.SerialReader) when the port
+    # has a reader thread, otherwise straight from serial_port.readline().
+    # `timeout` is how long the controller may stay silent, not how long an
+    # 'ok' may take: a long move holds back the 'ok' of the lines after it.
+    def __init__(self, serial_port, firmware="marlin", buffer_size=None, timeout=30, abort_event=None, reader=None):
+        self.serial_port = serial_port
+        self.reader = reader
+        self.abort_event = abort_event
+        self.firmware = firmware.lower()
+        if buffer_size is None:
+            buffer_size = GRBL_RX_BUFFER_SIZE if self.firmware == "grbl" else MARLIN_BUFSIZE
+        self.buffer_size = buffer_size
+        self.timeout = timeout  # Seconds without any reply before giving up
+
+        self.pending = deque()  # Byte length of every command still waiting for its 'ok'
+        self.pending_chars = 0
+        self.stale = 0  # How many of the oldest pending commands belong to an aborted stream
+        self.laser = None  # "M3", "M4" or "M5" as the lines written so far leave it
+        self.lines_sent = 0
+        self.bytes_sent = 0
+        self.errors = []
+
+    def power_command(self, power):
+        # Line that changes the laser power at this point of the stream. GRBL
+        # takes a bare S word. Marlin needs a G or M word on every line, and M3/M4
+        # switch the laser on, so it only gets one while the laser is on; its
+        # next M3 carries the power otherwise.
+        if self.firmware == "grbl":
+            return f"S{power}"
+        if self.laser in ("M3", "M4"):
+            return f"{self.laser} S{power}"
+        return None
+
+    def has_room(self, length):
+        # Always allow one command in flight, otherwise a line longer than
+        # the buffer could never be sent
+        if not self.pending:
+            return True
+        if self.firmware == "grbl":
+            return self.pending_chars + length <= self.buffer_size
+        return len(self.pending) < self.buffer_size
+
+    def send(self, command):
+        command = clean_command(command)
+        if not command:
+            return
+        data = (command + "\n").encode()
+        while not self.has_room(len(data)):
+            self.read_reply()
+        self.serial_port.write(data)
+        for code in LASER_CODE.findall(command.upper()):
+            self.laser = f"M{code}"
+        self.pending.append(len(data))
+        self.pending_chars += len(data)
+        self.lines_sent += 1
+        self.bytes_sent += len(data)
+
+    def stream(self, commands):
+        for command in commands:
+            self.send(command)
+        self.wait_until_done()
+
+    def wait_until_done(self):
+        while self.pending:
+            self.read_reply()
+
+    def abandon(self, extra=()):
+        # Stop waiting on the outstanding commands without forgetting them: the
+        # controller still answers the lines already in its buffer, and those
+        # late replies pay them off instead of counting against the next stream.
+        # `extra` are the byte lengths of lines written past the streamer that
+        # will be answered too (Marlin's real-time M410 gets an 'ok').
+        for length in extra:
+            self.pending.append(length)
+            self.pending_chars += length
+        self.stale = len(self.pending)
+        self.laser = None  # The stop may have switched it off, or lines may be missing
+
+    def drop_stale(self):
+        # The controller restarted or halted: the aborted lines will never be answered
+        for _ in range(self.stale):
+            self.pending_chars -= self.pending.popleft()
+        self.stale = 0
+
+    def reset(self):
+        # Forget outstanding commands, e.g. after the port was lost or the
+        # controller stopped answering
+        self.pending.clear()
+        self.pending_chars = 0
+        self.stale = 0
+        self.laser = None
+        if self.reader is not None:
+            while True:
+                try:
+                    self.reader.replies.get_nowait()  # Answers to the dropped commands
+                except queue.Empty:
+                    break
+
+    def acknowledge(self):
+        if self.pending:
+            self.pending_chars -= self.pending.popleft()
+            self.stale = max(0, self.stale - 1)
+
+    def next_reply(self):
+        # One reply, or None if nothing arrived within the port's read timeout
+        if self.reader is not None:
+            try:
+                return self.reader.replies.get(timeout=0.1)
+            except queue.Empty:
+                return None
+        raw = self.serial_port.readline()
+        if not raw:
+            return None
+        return classify(raw.decode(errors="replace").strip())
+
+    def read_reply(self):
+        # Any line counts as a sign of life: Marlin's 'busy:' keepalive,
+        # position reports, and on GRBL the answer to a '?' sent once the
+        # controller has been quiet for half the timeout
+        started = heard = time.monotonic()
+        probed = False
+        while True:
+            if self.abort_event is not None and self.abort_event.is_set():
+                raise StreamAborted("Stream aborted")
+            reply = self.next_reply()
+            if reply is not None and reply.text:
+                break
+            now = time.monotonic()
+            if self.reader is not None and self.reader.last_heard > heard:
+                heard = max(started, self.reader.last_heard)
+                probed = False
+            if self.firmware == "grbl" and not probed and now - heard > self.timeout / 2:
+                probed = True
+                self.serial_port.write(b"?")  # Real-time: answered even while the planner is full
+            if now - heard > self.timeout:
+                raise StreamError(f"Nothing from the controller for {self.timeout}s "
+                                  f"({len(self.pending)} commands outstanding)")
+        self.handle_reply(reply)
+        return reply
+
+    def handle_reply(self, reply):
+        if reply.kind == "ok":
+            self.acknowledge()
+        elif reply.kind == "error":
+            # GRBL answers a rejected line with 'error:N' instead of 'ok',
+            # Marlin prints 'Error:...' and still follows up with an 'ok'
+            self.errors.append(reply.text)
+            print("Controller error:", reply.text)
+            if self.firmware == "grbl":
+                self.acknowledge()
+        elif reply.kind == "alarm":
+            self.errors.append(reply.text)
+            if self.stale:
+                # The end of an aborted stream (GRBL reset mid-move, Marlin M112), not this one's fault
+                print("Controller halted:", reply.text)
+                self.drop_stale()
+                return
+            raise StreamError(f"Controller halted: {reply.text}")
+        elif reply.kind == "reset":
+            self.drop_stale()
+        elif reply.kind == "closed":
+            raise ConnectionError(f"Serial port closed: {reply.text}")
+        # Anything else ('echo:', 'busy:', position reports) is informational
+
+
+
+class SenderJob:
+    def __init__(self, name="job", on_done=None, on_progress=None, interleave=False):
+        self.name = name
+        self.interleave = interleave  # One line that may go between another job's lines (power, status query)
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.queued = 0  # Lines handed to the sender thread
+        self.sent = 0  # Lines written to the port
+        self.acked = 0  # Lines the controller has answered 'ok' to
+        self.fed_all = False
+        self.state = "running"  # running, done, aborted or failed
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+
+class PowerChange:
+    # Queued instead of a line: the command is chosen when it is written
+    # (GcodeStreamer.power_command), from the laser state the lines before it leave
+    def __init__(self, power):
+        self.power = power
+
+
+# Queue markers: end of a job, abort acknowledgement, thread shutdown and
+# "look at the priority queue"
+JOB_END = object()
+ABORT = object()
+STOP = object()
+WAKE = object()
+
+
+class SenderThread(threading.Thread):
+    # Owns the serial port while streaming. The Tk thread feeds commands into a
+    # bounded queue (start_job) and gets (kind, job) events back (poll_events).
+    # The port comes from `connection` (connection.SerialConnection) when the
+    # first line is sent, so nothing waits on it at startup.
+    def __init__(self, connection, firmware="marlin", queue_size=500, progress_interval=0.1):
+        super().__init__(name="gcode-sender", daemon=True)
+        self.connection = connection
+        self.commands = queue.Queue(maxsize=queue_size)
+        self.priority = queue.Queue()  # Interleaved lines (power, status queries), sent ahead of job lines
+        self.events = queue.Queue()
+        self.abort_event = threading.Event()
+        self.streamer = GcodeStreamer(None, firmware=firmware, abort_event=self.abort_event)
+        self.progress_interval = progress_interval
+        self.jobs = []  # Jobs with lines queued or in flight
+        self.abort_extra = []  # Byte lengths of real-time lines the controller will still answer
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    def busy(self):
+        # True while a job is running whose lines must not mix with another's
+        with self.lock:
+            return any(not job.interleave for job in self.jobs)
+
+    def put_priority(self, item):
+        # Called from the Tk thread for interleave jobs: the line goes out before
+        # any queued job line. WAKE gets the thread out of an empty-queue wait.
+        self.priority.put(item)
+        try:
+            self.commands.put_nowait(WAKE)
+        except queue.Full:
+            pass  # Not waiting: it checks the priority queue before every line
+
+    def run(self):
+        last_progress = 0.0
+        while True:
+            try:
+                item = self.priority.get_nowait()
+            except queue.Empty:
+                item = self.commands.get()
+            if item is WAKE:
+                continue
+            if item is STOP:
+                break
+            if item is ABORT:
+                # Lines already sent keep their place until the controller answers them
+                with self.lock:
+                    extra, self.abort_extra = self.abort_extra, []
+                self.streamer.abandon(extra)
+                self.abort_event.clear()
+                continue
+            job, command = item
+            if job.state != "running":
+                continue  # Leftovers of an aborted or failed job
+            try:
+                if command is JOB_END and job.interleave:
+                    # Done once written: its 'ok' only comes after every line ahead of it
+                    # in the controller's buffer, and waiting for that would stall the stream
+                    self.finish(job, "done")
+                    continue
+                if command is JOB_END:
+                    self.streamer.wait_until_done()
+                    job.acked = job.sent
+                    self.finish(job, "done")
+                    continue
+                if self.streamer.serial_port is None:
+                    self.streamer.serial_port = self.connection.wait(self.abort_event)
+                    self.streamer.reader = self.connection.reader
+                if isinstance(command, PowerChange):
+                    command = self.streamer.power_command(command.power)
+                    if command is None:
+                        continue  # Marlin with the laser off: the next M3 carries the power
+                self.streamer.send(command)
+                job.sent += 1
+                job.acked = max(0, job.sent - len(self.streamer.pending))
+                now = time.monotonic()
+                if now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    self.events.put(("progress", job))
+            except StreamAborted:
+                pass  # The ABORT marker behind it settles the streamer
+            except OSError as e:
+                # Port missing or gone (laser switched off, cable pulled): the
+                # next job connects again
+                self.streamer.reset()
+                self.streamer.serial_port = None
+                self.streamer.reader = None
+                self.connection.close()
+                job.error = e
+                self.finish(job, "failed")
+            except Exception as e:
+                self.streamer.reset()
+                job.error = e
+                self.finish(job, "failed")
+
+    def finish(self, job, state):
+        with self.lock:
+            if job not in self.jobs:
+                return  # Already reported as aborted
+            self.jobs.remove(job)
+        job.state = state
+        job.finished = time.monotonic()
+        self.events.put((state, job))
+
+    def fail(self, job, error):
+        # The job's command source broke (e.g. a file read error)
+        job.error = error
+        self.finish(job, "failed")
+
+    def abort(self, extra=()):
+        # Called from the Tk thread: drop every queued line and stop waiting for replies.
+        # `extra`: lines written straight to the port that will still get an 'ok'
+        with self.lock:
+            jobs, self.jobs = self.jobs, []
+            self.abort_extra.extend(extra)
+        for job in jobs:
+            job.state = "aborted"
+            job.finished = time.monotonic()
+            self.events.put(("aborted", job))
+        self.abort_event.set()
+        stopping = False
+        for lines in (self.priority, self.commands):
+            while True:
+                try:
+                    item = lines.get_nowait()
+                except queue.Empty:
+                    break
+                stopping = stopping or item is STOP
+        self.commands.put(ABORT)
+        if stopping:
+            self.commands.put(STOP)
+
+    def stop(self):
+        self.abort()
+        self.commands.put(STOP)
+
+
+def start_job(root, sender, commands, name="job", on_done=None, on_progress=None, chunk=200, interleave=False):
+    # Feed commands to the sender thread from the Tk thread without blocking it:
+    # at most `chunk` lines per tick, backing off while the queue is full.
+    # Jobs running at the same time share the queue and their lines mix, so
+    # check sender.busy() first unless the job is a single interleave line;
+    # those go ahead of the queued lines (sender.put_priority).
+    job = SenderJob(name, on_done, on_progress, interleave)
+    sender.submit(job)
+    put = sender.put_priority if interleave else sender.commands.put_nowait
+    lines = iter(commands)
+    waiting = [None]  # Line that did not fit into the queue on the last tick
+
+    def pump():
+        if job.state != "running":
+            return
+        for _ in range(chunk):
+            command = waiting[0]
+            if command is None:
+                try:
+                    command = next(lines, JOB_END)
+                except Exception as e:
+                    sender.fail(job, e)
+                    return
+            try:
+                put((job, command))
+            except queue.Full:
+                waiting[0] = command
+                root.after(10, pump)
+                return
+            waiting[0] = None
+            if command is JOB_END:
+                job.fed_all = True
+                return
+            job.queued += 1
+        root.after(1, pump)
+
+    pump()
+    return job
+
+
+def poll_events(root, sender, interval=50):
+    # Deliver sender thread events to the job callbacks on the Tk thread
+    while True:
+        try:
+            kind, job = sender.events.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "progress":
+            if job.on_progress:
+                job.on_progress(job)
+        elif job.on_done:
+            job.on_done(job)
+    root.after(interval, poll_events, root, sender, interval)
@@ -0,0 +1,190 @@
+import json
+import math
+from array import array
+
+try:
+    import numpy as np  # Optional: batch transforms run in one vectorised pass when available
+except ImportError:
+    np = None
+
+# The design as plain data. Segment endpoints live in one contiguous array of
+# doubles (x1, y1, x2, y2 per segment, canvas coordinates) and shapes are small
+# records pointing at a run of segments. The Tk canvas only displays this.
+
+
+class Shape:
+    def __init__(self, kind, first, count=0, params=None):
+        self.kind = kind  # "polyline" or "circle"
+        self.first = first  # Index of the shape's first segment
+        self.count = count  # Number of segments
+        self.params = params or {}
+
+
+class GeometryStore:
+    def __init__(self):
+        self.coords = array('d')
+        self.shapes = []
+
+    def __len__(self):
+        return len(self.coords) // 4
+
+    def clear(self):
+        self.coords = array('d')
+        self.shapes = []
+
+    def begin_shape(self, kind, **params):
+        shape = Shape(kind, len(self), 0, params)
+        self.shapes.append(shape)
+        return shape
+
+    def add_segment(self, x1, y1, x2, y2, shape=None):
+        # Appends a segment to `shape` (which must be the newest shape) and returns its index
+        if shape is None:
+            shape = self.begin_shape("polyline")
+        self.coords.extend((x1, y1, x2, y2))
+        shape.count += 1
+        return len(self) - 1
+
+    def add_circle(self, cx, cy, r):
+        return self.begin_shape("circle", cx=cx, cy=cy, r=r)
+
+    def circles(self):
+        return [(s.params["cx"], s.params["cy"], s.params["r"]) for s in self.shapes if s.kind == "circle"]
+
+    def segment(self, index):
+        x1, y1, x2, y2 = self.coords[index * 4:index * 4 + 4]
+        return (x1, y1), (x2, y2)
+
+    def segments(self):
+        # All segments as [(x1, y1), (x2, y2)] lists
+        return segment_pairs(self.coords)
+
+    def bounds(self):
+        xs = list(self.coords[0::2])
+        ys = list(self.coords[1::2])
+        for cx, cy, r in self.circles():
+            xs.extend((cx - r, cx + r))
+            ys.extend((cy - r, cy + r))
+        if not xs:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def centre(self):
+        bounds = self.bounds()
+        if bounds is None:
+            return None
+        return (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2
+
+
+def save_design(store, file_path):
+    # JSON with one [x1, y1, x2, y2] list per segment plus the shape records
+    data = {
+        "segments": [store.coords[i:i + 4].tolist() for i in range(0, len(store.coords), 4)],
+        "shapes": [{"kind": s.kind, "first": s.first, "count": s.count, "params": s.params}
+                   for s in store.shapes],
+    }
+    with open(file_path, 'w') as f:
+        json.dump(data, f)
+
+
+def load_design(file_path):
+    # Reads a design saved by save_design, or a plain text file with one
+    # "x1 y1 x2 y2" segment per line
+    store = GeometryStore()
+    if file_path.lower().endswith(".json"):
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        for segment in data.get("segments", []):
+            store.coords.extend(segment)
+        for record in data.get("shapes", []):
+            store.shapes.append(Shape(record["kind"], record["first"], record["count"], record["params"]))
+    else:
+        with open(file_path, 'r') as f:
+            shape = store.begin_shape("polyline")
+            for line in f:
+                values = line.replace(",", " ").split()
+                if len(values) == 4:
+                    store.add_segment(*map(float, values), shape)
+    return store
+
+
+def transform_coords(coords, machine_height, mm_per_px=1.0, rotation=0.0,
+                     mirror_x=False, mirror_y=False, offset_x=0.0, offset_y=0.0, centre=None):
+    # Canvas pixels (origin top-left) -> machine millimetres (origin bottom-left)
+    # for a flat x, y, x, y... sequence, in one pass. Mirroring and rotation
+    # (degrees, counter-clockwise) are about `centre` (canvas coordinates,
+    # default the middle of the points) so the design stays in place on the
+    # bed; the offset is applied last.
+    if len(coords) == 0:
+        return array('d')
+    if centre is not None:
+        centre = (centre[0] * mm_per_px, (machine_height - centre[1]) * mm_per_px)
+    if np is not None:
+        xy = np.array(coords, dtype=float).reshape(-1, 2)
+        xy[:, 1] = machine_height - xy[:, 1]
+        xy *= mm_per_px
+        if mirror_x or mirror_y or rotation:
+            if centre is None:
+                centre = (xy.min(axis=0) + xy.max(axis=0)) / 2
+            xy -= centre
+            if mirror_x:
+                xy[:, 0] = -xy[:, 0]
+            if mirror_y:
+                xy[:, 1] = -xy[:, 1]
+            if rotation:
+                a = math.radians(rotation)
+                xy = xy @ np.array([[math.cos(a), math.sin(a)], [-math.sin(a), math.cos(a)]])
+            xy += centre
+        xy += (offset_x, offset_y)
+        return xy.reshape(-1)
+
+    xs = [x * mm_per_px for x in coords[0::2]]
+    ys = [(machine_height - y) * mm_per_px for y in coords[1::2]]
+    if mirror_x or mirror_y or rotation:
+        if centre is None:
+            centre = ((min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2)
+        cx, cy = centre
+        sx = -1.0 if mirror_x else 1.0
+        sy = -1.0 if mirror_y else 1.0
+        a = math.radians(rotation)
+        cos_a, sin_a = math.cos(a), math.sin(a)
+        xs, ys = ([cx + (x - cx) * sx * cos_a - (y - cy) * sy * sin_a for x, y in zip(xs, ys)],
+                  [cy + (x - cx) * sx * sin_a + (y - cy) * sy * cos_a for x, y in zip(xs, ys)])
+    result = array('d', bytes(8 * 2 * len(xs)))
+    result[0::2] = array('d', [x + offset_x for x in xs])
+    result[1::2] = array('d', [y + offset_y for y in ys])
+    return result
+
+
+def segment_pairs(coords):
+    # Flat x1, y1, x2, y2... sequence -> [[(x1, y1), (x2, y2)], ...]
+    c = coords.tolist()
+    return [[(c[i], c[i + 1]), (c[i + 2], c[i + 3])] for i in range(0, len(c), 4)]
+
+
+def draw_segment(canvas, x1, y1, x2, y2):
+    # Tagging lines with 'line' for easy removal
+    return canvas.create_line(x1, y1, x2, y2, fill="green", width=2, tags="line")
+
+
+def draw_circle(canvas, cx, cy, r):
+    return canvas.create_oval(cx - r, cy - r, cx + r, cy + r, outline="green", width=2, tags="line")
+
+
+def redraw(canvas, store):
+    # Rebuild the canvas view of the design
+    canvas.delete("line")
+    c = store.coords
+    for i in range(0, len(c), 4):
+        draw_segment(canvas, c[i], c[i + 1], c[i + 2], c[i + 3])
+    for cx, cy, r in store.circles():
+        draw_circle(canvas, cx, cy, r)
+
+
+def transform_circles(circles, machine_height, centre=None, mm_per_px=1.0, **transform):
+    # Circle centres go through the same transform as the segments; radii only scale
+    coords = array('d')
+    for cx, cy, _ in circles:
+        coords.extend((cx, cy))
+    centres = transform_coords(coords, machine_height, mm_per_px=mm_per_px, centre=centre, **transform).tolist()
+    return [(centres[2 * k], centres[2 * k + 1], r * mm_per_px) for k, (_, _, r) in enumerate(circles)]
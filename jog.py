@@ -0,0 +1,151 @@
+import time
+
+from gcode_optimizer import format_number
+from gcode_sender import start_job
+
+# Continuous jogging while an arrow key is held. Key auto-repeat is folded
+# into the one jog already running, so holding a key costs a fixed amount of
+# serial traffic however fast the keyboard repeats.
+#   GRBL:   one $J= jog to the machine limit on key-down, the 0x85 jog-cancel
+#           byte on key-up; GRBL decelerates and drops the rest of the jog at once
+#   Marlin: has no jog cancel, so short relative moves are fed while the key is
+#           held, each JOG_CHUNK_TIME long, never more than JOG_MAX_QUEUED
+#           ahead; the head stops within a couple of chunks of key-up
+# Neither goes past the machine limits, so a lost key release (focus gone
+# while the key was held) cannot run the head into the frame, and a GRBL jog
+# is not refused for crossing the soft limits (error:15). Position reports
+# lag behind a jog, so for a while after one the limits are measured from
+# where that jog can have left the head as well.
+
+JOG_TRAVEL = 1000.0  # mm; longest jog when the machine size is not known
+JOG_CHUNK_TIME = 0.1  # s of motion per Marlin chunk
+JOG_MAX_QUEUED = 3  # Marlin chunks allowed in flight before feeding pauses
+RELEASE_DELAY = 30  # ms; X11 auto-repeat sends release+press pairs, so a release only counts if no press follows
+REPORT_LAG = 2.0  # s until a position report shows where a jog ended (M154 S1, or M114 polling once jobs are done)
+
+# Arrow keys -> (axis, direction)
+JOG_KEYS = {"Up": ("Y", 1), "Down": ("Y", -1), "Left": ("X", -1), "Right": ("X", 1)}
+
+JOG_CANCEL = b"\x85"
+
+
+class Jogger:
+    def __init__(self, root, sender, connection, firmware="marlin", machine_size=None, position=None):
+        self.root = root
+        self.sender = sender
+        self.connection = connection
+        self.firmware = firmware
+        self.machine_size = machine_size  # (width, height) in mm
+        self.position = position  # Callable returning the head's (x, y) in machine mm
+        self.active = None  # (key, axis, direction, feed) of the running jog
+        self.start = None  # ((x low, x high), (y low, y high)) the head may be in as the running jog begins
+        self.travelled = 0.0  # mm asked of the running jog so far
+        self.span = None  # Same, for where the last jog can have left the head
+        self.span_until = 0.0  # time.monotonic() until which reports may not show that yet
+        self.release_timer = None
+        self.chunk_timer = None
+        self.jog_job = None  # GRBL $J= job
+        self.chunks = []  # Marlin chunk jobs not yet answered
+
+    def press(self, key, feed):
+        if self.release_timer is not None:
+            self.root.after_cancel(self.release_timer)
+            self.release_timer = None
+            if self.active is not None and self.active[0] == key:
+                return  # Auto-repeat: the key never really went up
+            self.stop()  # Released and another arrow pressed straight after
+        if self.active is not None:
+            return  # Repeat while jogging, or a second arrow key: keep the running jog
+        axis, direction = JOG_KEYS[key]
+        self.start = self.start_span()
+        self.travelled = 0.0
+        self.active = (key, axis, direction, feed)
+        if self.firmware == "grbl":
+            travel = self.travel_left()
+            if travel < 0.001:
+                self.active = None  # Already at the limit
+                return
+            self.travelled = travel
+            self.jog_job = start_job(self.root, self.sender, [
+                f"$J=G91 G21 {axis}{format_number(direction * travel, 3)} F{format_number(feed, 3)}"], name="Jog")
+        else:
+            start_job(self.root, self.sender, ["G91"], name="Jog")
+            self.send_chunk()  # One chunk ahead from the start so the planner never runs dry
+            self.feed_chunk()
+
+    def release(self, key):
+        if self.active is not None and self.active[0] == key and self.release_timer is None:
+            self.release_timer = self.root.after(RELEASE_DELAY, self.stop)
+
+    def stop(self):
+        self.release_timer = None
+        if self.firmware == "grbl":
+            if self.jog_job is not None and self.jog_job.state == "running":
+                # The $J= line has not been taken yet; a cancel now would arrive before it
+                self.release_timer = self.root.after(5, self.stop)
+                return
+            self.connection.write_realtime(JOG_CANCEL)
+        else:
+            if self.chunk_timer is not None:
+                self.root.after_cancel(self.chunk_timer)
+                self.chunk_timer = None
+            start_job(self.root, self.sender, ["G90"], name="Jog")
+        self.end_span()
+        self.active = None
+
+    def start_span(self):
+        # Where the head may be: the reported position, widened by where the last
+        # jog can have left it while reports may still be behind
+        reported = None if self.position is None else self.position()
+        recent = self.span is not None and time.monotonic() < self.span_until
+        if reported is None:
+            return self.span if recent else None
+        if not recent:
+            return tuple((value, value) for value in reported)
+        return tuple((min(low, value), max(high, value)) for (low, high), value in zip(self.span, reported))
+
+    def end_span(self):
+        if self.start is None:
+            return
+        _, axis, direction, _ = self.active
+        index = 0 if axis == "X" else 1
+        low, high = self.start[index]
+        moved = direction * self.travelled
+        if self.firmware == "grbl":
+            # Cancelled somewhere along the $J= move
+            low, high = low + min(0.0, moved), high + max(0.0, moved)
+        else:
+            low, high = low + moved, high + moved
+        span = list(self.start)
+        span[index] = (low, high)
+        self.span = tuple(span)
+        self.span_until = time.monotonic() + JOG_MAX_QUEUED * JOG_CHUNK_TIME + REPORT_LAG
+
+    def send_chunk(self):
+        _, axis, direction, feed = self.active
+        self.chunks = [job for job in self.chunks if job.state == "running"]
+        if len(self.chunks) < JOG_MAX_QUEUED:
+            distance = min(feed / 60 * JOG_CHUNK_TIME, self.travel_left())
+            if distance < 0.001:
+                return  # At the limit; wait for the key to come up
+            self.travelled += distance
+            self.chunks.append(start_job(self.root, self.sender, [
+                f"G1 {axis}{format_number(direction * distance, 3)} F{format_number(feed, 3)}"], name="Jog"))
+
+    def travel_left(self):
+        # mm the running jog may still ask for before it reaches the machine limit
+        _, axis, direction, _ = self.active
+        if self.machine_size is None or self.start is None:
+            return max(0.0, JOG_TRAVEL - self.travelled)
+        index = 0 if axis == "X" else 1
+        low, high = self.start[index]
+        left = self.machine_size[index] - high if direction > 0 else low
+        return max(0.0, min(left, JOG_TRAVEL) - self.travelled)
+
+    def feed_chunk(self):
+        # Marlin: one chunk per chunk time while the key is held, so the queue stays as it started
+        self.chunk_timer = None
+        if self.active is None:
+            return
+        self.send_chunk()
+        self.chunk_timer = self.root.after(int(JOG_CHUNK_TIME * 1000), self.feed_chunk)
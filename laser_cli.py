@@ -0,0 +1,101 @@
+import argparse
+import sys
+import time
+
+from gcode_export import export_gcode
+from gcode_sender import GcodeStreamer
+from geometry import load_design
+from path_optimizer import describe_travel
+
+# Headless batch tool: design file -> G-code file or straight to the laser,
+# through the same export pipeline as the Engrave button.
+#
+#   python laser_cli.py part.json -o part.gcode
+#   python laser_cli.py part.json --port /dev/ttyUSB0 --speed 1000 --power 800
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and stream laser G-code without the GUI.")
+    parser.add_argument("design", help="Design file saved by the draw tool (.json) or x1 y1 x2 y2 lines (.txt)")
+    parser.add_argument("-o", "--output", help="Write the G-code to this file")
+    parser.add_argument("--port", help="Stream the G-code to this serial port, e.g. COM3 or /dev/ttyUSB0")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--firmware", choices=("marlin", "grbl"), default="marlin")
+    parser.add_argument("--speed", type=float, default=1000, help="Cutting feed rate (mm/min)")
+    parser.add_argument("--power", type=float, default=1000, help="Laser power (S)")
+    parser.add_argument("--travel-speed", type=float, default=2000, help="Laser-off feed rate (mm/min)")
+    parser.add_argument("--machine-height", type=float, default=860, help="Bed height in canvas pixels")
+    parser.add_argument("--mm-per-px", type=float, default=1.0)
+    parser.add_argument("--rotation", type=float, default=0.0, help="Degrees counter-clockwise")
+    parser.add_argument("--mirror-x", action="store_true")
+    parser.add_argument("--mirror-y", action="store_true")
+    parser.add_argument("--offset-x", type=float, default=0.0)
+    parser.add_argument("--offset-y", type=float, default=0.0)
+    parser.add_argument("--precision", type=int, default=3)
+    parser.add_argument("--no-arcs", action="store_true", help="Split circles into chords instead of G2 arcs")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Chord tolerance in mm")
+    parser.add_argument("--order-time", type=float, default=1.0, help="Seconds spent improving the cut order")
+    args = parser.parse_args(argv)
+    if not args.output and not args.port:
+        parser.error("give --output and/or --port")
+    return args
+
+
+def open_port(port, baud):
+    import serial  # Only needed when streaming
+    return serial.Serial(port, baud, timeout=1)
+
+
+def stream(gcode_lines, port, baud, firmware):
+    serial_port = open_port(port, baud)
+    try:
+        streamer = GcodeStreamer(serial_port, firmware=firmware)
+        started = time.monotonic()
+        last_report = started
+        for command in gcode_lines:
+            streamer.send(command)
+            now = time.monotonic()
+            if now - last_report >= 1.0:
+                last_report = now
+                print(f"Sent {streamer.lines_sent}/{len(gcode_lines)} lines")
+        streamer.wait_until_done()
+        elapsed = max(time.monotonic() - started, 1e-9)
+    finally:
+        serial_port.close()
+    print(f"Streamed {streamer.lines_sent} lines ({streamer.bytes_sent} bytes) in {elapsed:.1f}s: "
+          f"{streamer.lines_sent / elapsed:.0f} lines/s, {streamer.bytes_sent / elapsed:.0f} bytes/s")
+    if streamer.errors:
+        print(f"{len(streamer.errors)} controller errors, first: {streamer.errors[0]}")
+    return streamer
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.monotonic()
+    design = load_design(args.design)
+    transform = {"mm_per_px": args.mm_per_px, "rotation": args.rotation,
+                 "mirror_x": args.mirror_x, "mirror_y": args.mirror_y,
+                 "offset_x": args.offset_x, "offset_y": args.offset_y}
+    gcode_lines, stats, _ = export_gcode(
+        design, args.machine_height, args.speed, args.power, args.travel_speed,
+        precision=args.precision, modal_motion=args.firmware == "grbl", transform=transform,
+        use_arcs=not args.no_arcs, tolerance=args.tolerance, time_limit=args.order_time)
+    elapsed = max(time.monotonic() - started, 1e-9)
+    size = sum(len(line) + 1 for line in gcode_lines)
+    print(f"Generated {len(gcode_lines)} lines ({size} bytes) from {len(design)} segments in {elapsed:.2f}s. "
+          f"{describe_travel(stats)}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write("\n".join(gcode_lines))
+            f.write("\n")
+        print(f"G-code written to {args.output}")
+    if args.port:
+        streamer = stream(gcode_lines, args.port, args.baud, args.firmware)
+        if streamer.errors:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
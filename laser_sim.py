@@ -0,0 +1,550 @@
+import argparse
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# A laser controller in software, for trying the tools and benchmarking them
+# without a machine. SimulatedController behaves like an open pyserial port
+# (write, readline, close), so it can be handed to GcodeStreamer,
+# SerialReader or SerialConnection(open_port=...) directly. Run this file to
+# put it behind a pseudo-terminal that any serial program can open:
+#
+#   python laser_sim.py --firmware grbl --baud 115200
+#   LASER_PORT=/dev/pts/5 python lasersaw_1.py
+#
+# Modelled: transfer time at the baud rate (8N1, both directions), the
+# receive buffer (GRBL: 128 byte ring; Marlin: 128 byte ring plus BUFSIZE
+# command slots), 'ok' once a command has been executed (moves: once they are
+# in the planner), planner depth, and move execution at the programmed feed
+# (no acceleration). Overflowing the receive buffer loses data, as on the
+# real thing. Real-time commands (GRBL ? ! ~ 0x18 0x85, Marlin M112/M410/M108
+# with EMERGENCY_PARSER) act on arrival. Marlin sends 'busy:' while it cannot
+# take a line. Position is reported by GRBL status reports and Marlin
+# M114/M154.
+
+GRBL_REALTIME = b"?!~\x18\x85"
+MARLIN_EMERGENCY = ("M112", "M410", "M108")
+WORD = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+MOVE = re.compile(r"(G0*[0-3](?![\d.])|\$J=)")
+
+
+class Block:
+    def __init__(self, start, end, duration, feed, jog=False):
+        self.start = start  # (x, y) where the move begins
+        self.end = end
+        self.duration = duration  # Simulated seconds
+        self.feed = feed
+        self.jog = jog
+        self.started = None  # Simulated time the head began this move
+        self.finishes = None
+
+
+class SimulatedController:
+    def __init__(self, firmware="marlin", baudrate=115200, rx_buffer=128, bufsize=4, planner_depth=16,
+                 rapid_rate=3000.0, default_feed=1000.0, min_segment_time=0.0, emergency_parser=True,
+                 host_keepalive=2.0, time_scale=1.0, timeout=1.0):
+        self.firmware = firmware.lower()
+        self.grbl = self.firmware == "grbl"
+        self.byte_time = 10.0 / baudrate  # Start bit, 8 data bits, stop bit
+        self.rx_size = rx_buffer
+        self.bufsize = 0 if self.grbl else bufsize  # GRBL parses straight from the ring
+        self.planner_depth = planner_depth
+        self.rapid_rate = rapid_rate
+        self.min_segment_time = min_segment_time
+        self.emergency_parser = emergency_parser
+        self.host_keepalive = 0.0 if self.grbl else host_keepalive  # Marlin 'busy:' interval, 0 for none
+        self.time_scale = time_scale  # > 1 runs the simulation faster than real time
+        self.timeout = timeout  # readline() timeout in real seconds, like pyserial's
+
+        self.lock = threading.Condition()
+        self.t0 = time.monotonic()
+        self.closed = False
+        self.incoming = deque()  # [first byte arrival time, data, bytes already delivered]
+        self.in_free_at = 0.0  # When the host -> controller line is next idle
+        self.outgoing = deque()  # (arrival time, reply line)
+        self.out_free_at = 0.0
+        self.rx = bytearray()
+        self.partial = bytearray()  # Current line as it arrives, for the emergency parser
+        self.queue = deque()  # Marlin command slots
+        self.planner = deque()
+        self.wait_for_moves = False  # M400 / G4 holding up the parser
+        self.blocked = False  # The parser cannot take the next line
+        self.next_busy = None
+
+        self.position = (0.0, 0.0)  # Where the planner's last move ends
+        self.mode = 0  # Modal motion (G0-G3)
+        self.absolute = True
+        self.inches = False
+        self.feed = default_feed
+        self.power = 0.0
+        self.laser = False
+        self.hold_at = None  # GRBL feed hold start
+        self.alarm = False  # GRBL alarm lock
+        self.killed = False  # Marlin after M112
+        self.auto_report = 0.0  # Marlin M154 interval
+        self.next_report = None
+        self.idle_since = None
+
+        self.stats = {"lines": 0, "bytes": 0, "moves": 0, "overflows": 0, "starvation_events": 0,
+                      "starved_time": 0.0, "move_time": 0.0, "max_rx": 0, "max_planner": 0}
+        self.thread = threading.Thread(target=self.run, name="laser-sim", daemon=True)
+        self.thread.start()
+
+    # --- pyserial side -------------------------------------------------
+
+    def clock(self):
+        return (time.monotonic() - self.t0) * self.time_scale
+
+    def write(self, data):
+        with self.lock:
+            if self.closed:
+                raise OSError("Simulated port closed")
+            now = self.clock()
+            start = max(now, self.in_free_at)
+            self.in_free_at = start + len(data) * self.byte_time
+            self.incoming.append([start, bytes(data), 0])
+            self.lock.notify_all()
+        return len(data)
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise OSError("Simulated port closed")
+                now = self.clock()
+                if self.outgoing and self.outgoing[0][0] <= now:
+                    return (self.outgoing.popleft()[1] + "\n").encode()
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return b""
+                wait = left
+                if self.outgoing:
+                    wait = min(wait, (self.outgoing[0][0] - now) / self.time_scale)
+                self.lock.wait(max(wait, 0.0005))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            now = self.clock()
+            return sum(len(line) + 1 for arrival, line in self.outgoing if arrival <= now)
+
+    # --- controller side -----------------------------------------------
+
+    def run(self):
+        with self.lock:
+            while not self.closed:
+                now = self.clock()
+                self.receive(now)
+                self.execute(now)
+                self.parse(now)
+                self.report(now)
+                wake = self.next_event(now)
+                self.lock.notify_all()  # Replies may be waiting for readline()
+                self.lock.wait(None if wake is None else max((wake - now) / self.time_scale, 0.0002))
+
+    def next_event(self, now):
+        times = []
+        if self.incoming:
+            # Only whole lines matter to the parser, so wake at the next line end
+            start, data, done = self.incoming[0]
+            end = data.find(b"\n", done)
+            times.append(start + ((end if end >= 0 else len(data) - 1) + 1) * self.byte_time)
+        if self.planner and self.planner[0].finishes is not None and self.hold_at is None:
+            times.append(self.planner[0].finishes)
+        if self.next_report is not None:
+            times.append(self.next_report)
+        if self.next_busy is not None:
+            times.append(self.next_busy)
+        return min(times) if times else None
+
+    def reply(self, now, line):
+        start = max(now, self.out_free_at)
+        self.out_free_at = start + (len(line) + 1) * self.byte_time
+        self.outgoing.append((self.out_free_at, line))
+
+    def receive(self, now):
+        # Deliver every byte that has finished crossing the wire by now
+        while self.incoming:
+            item = self.incoming[0]
+            start, data, done = item
+            arrived = min(len(data), int((now - start) / self.byte_time + 1e-9))
+            for byte in data[done:arrived]:
+                self.receive_byte(now, byte)
+            item[2] = max(done, arrived)
+            if item[2] < len(data):
+                break
+            self.incoming.popleft()
+
+    def receive_byte(self, now, byte):
+        if self.grbl and byte in GRBL_REALTIME:
+            self.realtime(now, bytes([byte]))
+            return
+        if self.killed:
+            return
+        if len(self.rx) < self.rx_size:
+            self.rx.append(byte)
+            self.stats["bytes"] += 1
+            self.stats["max_rx"] = max(self.stats["max_rx"], len(self.rx))
+        else:
+            self.stats["overflows"] += 1  # Lost, as on a real controller
+        if byte != 10:
+            self.partial.append(byte)
+            return
+        command = self.partial.decode(errors="replace").strip().upper().split(" ")[0]
+        self.partial.clear()
+        if not self.grbl and self.emergency_parser and command in MARLIN_EMERGENCY:
+            # Acted on as it arrives; the queued copy still gets its 'ok' later
+            self.emergency(now, command)
+
+    def realtime(self, now, byte):
+        if byte == b"?":
+            self.reply(now, self.status_report(now))
+        elif byte == b"!":
+            if self.hold_at is None and self.planner:
+                self.hold_at = now
+        elif byte == b"~":
+            if self.hold_at is not None:
+                self.shift(now - self.hold_at)
+                self.hold_at = None
+        elif byte == b"\x18":
+            moving = bool(self.planner) and self.hold_at is None
+            self.stop(now)
+            self.rx.clear()
+            self.partial.clear()
+            self.hold_at = None
+            self.laser = False
+            self.reply(now, "Grbl 1.1h ['$' for help]")
+            if moving:
+                self.alarm = True  # Position is lost when reset while moving
+                self.reply(now, "ALARM:3")
+        elif byte == b"\x85":
+            if self.planner and self.planner[0].jog:
+                self.stop(now)
+
+    def emergency(self, now, command):
+        if command == "M112":
+            self.stop(now)
+            self.laser = False
+            self.killed = True  # Dead until reset
+            self.reply(now, "Error:Printer halted. kill() called!")
+        elif command == "M410":
+            self.stop(now)
+
+    def shift(self, delay):
+        head = self.planner[0]
+        head.started += delay
+        head.finishes += delay
+
+    def stop(self, now):
+        # Halt where the head is and forget the planned moves
+        if self.planner:
+            self.position = self.head_position(now)
+            self.planner.clear()
+            self.idle_since = None  # Deliberately stopped, not starved
+        self.wait_for_moves = False
+
+    def head_position(self, now):
+        if not self.planner or self.planner[0].started is None:
+            return self.position
+        head = self.planner[0]
+        if self.hold_at is not None:
+            now = self.hold_at
+        if head.duration <= 0:
+            return head.end
+        f = min(max((now - head.started) / head.duration, 0.0), 1.0)
+        return (head.start[0] + (head.end[0] - head.start[0]) * f,
+                head.start[1] + (head.end[1] - head.start[1]) * f)
+
+    def execute(self, now):
+        # Retire finished moves; the next one starts the moment the last ends
+        while self.planner and self.hold_at is None:
+            head = self.planner[0]
+            if head.started is None:
+                head.started = now
+                head.finishes = now + head.duration
+            if head.finishes > now:
+                break
+            self.planner.popleft()
+            self.stats["move_time"] += head.duration
+            if self.planner:
+                self.planner[0].started = head.finishes
+                self.planner[0].finishes = head.finishes + self.planner[0].duration
+            else:
+                self.idle_since = head.finishes
+        if not self.planner and self.wait_for_moves:
+            self.wait_for_moves = False
+
+    def next_line(self):
+        # Marlin moves complete lines from the ring into its command slots;
+        # GRBL parses straight from the ring
+        if self.bufsize:
+            while len(self.queue) < self.bufsize and b"\n" in self.rx:
+                end = self.rx.index(b"\n")
+                self.queue.append(self.rx[:end].decode(errors="replace"))
+                del self.rx[:end + 1]
+            return self.queue[0] if self.queue else None
+        if b"\n" not in self.rx:
+            return None
+        return self.rx[:self.rx.index(b"\n")].decode(errors="replace")
+
+    def consume_line(self):
+        if self.bufsize:
+            self.queue.popleft()
+        else:
+            del self.rx[:self.rx.index(b"\n") + 1]
+
+    def parse(self, now):
+        self.blocked = self.wait_for_moves
+        while not self.killed and not self.wait_for_moves:
+            line = self.next_line()
+            if line is None:
+                return
+            command = line.split(";", 1)[0].strip().upper()
+            if command.startswith("N") and "*" in command:
+                command = command.split(" ", 1)[1].rsplit("*", 1)[0]  # Line number and checksum
+            if self.is_move(command) and len(self.planner) >= self.planner_depth:
+                self.blocked = True
+                return  # Planner full: the line waits, and so does its 'ok'
+            self.consume_line()
+            self.stats["lines"] += 1
+            if command:
+                self.run_command(now, command)
+            else:
+                self.reply(now, "ok")
+
+    def is_move(self, command):
+        return bool(MOVE.match(command)) or (self.grbl and command[:1] in ("X", "Y"))
+
+    def run_command(self, now, command):
+        if self.grbl and command.startswith("$"):
+            if command == "$X":
+                self.alarm = False
+                self.reply(now, "[MSG:Caution: Unlocked]")
+                self.reply(now, "ok")
+            elif command.startswith("$J="):
+                self.motion(now, command[3:], jog=True)
+            else:
+                self.reply(now, "ok")
+            return
+        if self.grbl and self.alarm:
+            self.reply(now, "error:9")  # Locked until $X
+            return
+        words = [(letter, float(value)) for letter, value in WORD.findall(command)]
+        codes = [(letter, value) for letter, value in words if letter in "GM"]
+        if not words:
+            self.unknown(now, command)
+            return
+        for letter, value in codes:
+            code = f"{letter}{value:g}"
+            if code in ("G90", "G91"):
+                self.absolute = code == "G90"
+            elif code in ("G20", "G21"):
+                self.inches = code == "G20"
+            elif code == "G28":
+                self.position = (0.0, 0.0)
+            elif code == "G92":
+                x, y = self.position
+                values = dict(words)
+                self.position = (values.get("X", x), values.get("Y", y))
+            elif code in ("M3", "M4"):
+                self.laser = True
+            elif code == "M5":
+                self.laser = False
+            elif code in ("M400", "G4"):
+                self.wait_for_moves = bool(self.planner)
+            elif code == "M114":
+                self.reply(now, self.position_report(self.position))
+            elif code == "M154":
+                self.auto_report = dict(words).get("S", 0.0)
+                self.next_report = now + self.auto_report if self.auto_report > 0 else None
+            elif code in ("M112", "M410"):
+                self.emergency(now, code)  # Reached the queue (no EMERGENCY_PARSER, or the queued copy)
+                if self.killed:
+                    return
+            elif code not in ("G0", "G1", "G2", "G3", "G17", "G94", "M2", "M30", "M108"):
+                self.unknown(now, command)
+                return
+        if not codes and not self.grbl:
+            self.unknown(now, command)  # Marlin needs a G or M word on every line
+            return
+        for letter, value in words:
+            if letter == "S":
+                self.power = value
+            elif letter == "F":
+                self.feed = value * (25.4 if self.inches else 1.0)
+        moves = [value for letter, value in codes if letter == "G" and value in (0, 1, 2, 3)]
+        if moves or (not codes and any(letter in "XY" for letter, _ in words)):
+            self.motion(now, command)
+            return
+        self.reply(now, "ok")
+
+    def unknown(self, now, command):
+        if self.grbl:
+            self.reply(now, "error:20")
+        else:
+            self.reply(now, f'echo:Unknown command: "{command}"')
+            self.reply(now, "ok")
+
+    def motion(self, now, command, jog=False):
+        words = dict((letter, float(value)) for letter, value in WORD.findall(command))
+        g_codes = [float(value) for letter, value in WORD.findall(command) if letter == "G"]
+        relative = (not self.absolute and not jog) or (jog and 91 in g_codes)
+        motion = next((int(code) for code in g_codes if code in (0, 1, 2, 3)), 0 if jog else self.mode)
+        if self.grbl and motion in (2, 3) and "X" not in words and "Y" not in words:
+            self.reply(now, "error:26")  # GRBL needs an axis word in the plane for every arc
+            return
+        if not jog:
+            self.mode = motion
+        scale = 25.4 if self.inches else 1.0
+        x, y = self.position
+        if relative:
+            end = (x + words.get("X", 0.0) * scale, y + words.get("Y", 0.0) * scale)
+        else:
+            end = (words.get("X", x / scale) * scale, words.get("Y", y / scale) * scale)
+        feed = words.get("F", self.feed / scale) * scale if jog else self.feed
+        if motion in (2, 3):
+            cx, cy = x + words.get("I", 0.0) * scale, y + words.get("J", 0.0) * scale
+            r = math.hypot(x - cx, y - cy)
+            a0 = math.atan2(y - cy, x - cx)
+            a1 = math.atan2(end[1] - cy, end[0] - cx)
+            sweep = (a0 - a1) if motion == 2 else (a1 - a0)
+            sweep %= 2 * math.pi
+            if sweep < 1e-9:
+                sweep = 2 * math.pi  # Same start and end: a full circle
+            length = r * sweep
+        else:
+            length = math.hypot(end[0] - x, end[1] - y)
+        rate = self.rapid_rate if motion == 0 and not jog else feed
+        self.position = end
+        if length > 0:
+            duration = max(length / (rate / 60.0), self.min_segment_time)
+            self.plan(now, Block((x, y), end, duration, rate, jog))
+        self.reply(now, "ok")
+
+    def plan(self, now, block):
+        if not self.planner and self.idle_since is not None:
+            # The machine stood still waiting for this move
+            gap = now - self.idle_since
+            if gap > 0:
+                self.stats["starvation_events"] += 1
+                self.stats["starved_time"] += gap
+        self.idle_since = None
+        self.planner.append(block)
+        self.stats["moves"] += 1
+        self.stats["max_planner"] = max(self.stats["max_planner"], len(self.planner))
+        if len(self.planner) == 1:
+            block.started = now
+            block.finishes = now + block.duration
+
+    def report(self, now):
+        # Marlin HOST_KEEPALIVE_FEATURE: 'busy:' every couple of seconds while it cannot take commands
+        if self.host_keepalive and self.blocked and not self.killed:
+            if self.next_busy is None:
+                self.next_busy = now + self.host_keepalive
+            elif now >= self.next_busy:
+                self.reply(now, "echo:busy: processing")
+                self.next_busy = now + self.host_keepalive
+        else:
+            self.next_busy = None
+        if self.next_report is not None and now >= self.next_report:
+            self.reply(now, self.position_report(self.head_position(now)))
+            self.next_report = now + self.auto_report
+
+    def position_report(self, position):
+        return f"X:{position[0]:.2f} Y:{position[1]:.2f} Z:0.00 E:0.00 Count X:0 Y:0 Z:0"
+
+    def status_report(self, now):
+        if self.alarm:
+            state = "Alarm"
+        elif self.hold_at is not None:
+            state = "Hold:0"
+        elif self.planner:
+            state = "Jog" if self.planner[0].jog else "Run"
+        else:
+            state = "Idle"
+        x, y = self.head_position(now)
+        feed = self.planner[0].feed if self.planner and self.hold_at is None else 0
+        return f"<{state}|MPos:{x:.3f},{y:.3f},0.000|FS:{feed:g},{self.power if self.laser else 0:g}>"
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0.0 if isinstance(self.stats[key], float) else 0
+            self.idle_since = None
+
+    def wait_idle(self, timeout=None):
+        # Blocks until every byte written has been taken in and every move run
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self.incoming or self.planner or b"\n" in self.rx or self.queue:
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                self.lock.wait(0.01)
+        return True
+
+
+def serve_pty(controller):
+    # Bridge the simulator to a pseudo-terminal; returns the device name
+    import tty  # POSIX only
+    master, slave = os.openpty()
+    tty.setraw(slave)
+
+    def to_controller():
+        while True:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            controller.write(data)
+
+    def to_host():
+        while True:
+            try:
+                line = controller.readline()
+            except OSError:
+                break
+            if line:
+                os.write(master, line)
+
+    threading.Thread(target=to_controller, name="laser-sim-rx", daemon=True).start()
+    threading.Thread(target=to_host, name="laser-sim-tx", daemon=True).start()
+    return os.ttyname(slave)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated Marlin/GRBL laser controller on a pseudo-terminal.")
+    parser.add_argument("--firmware", choices=("marlin", "grbl"), default="marlin")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--rx-buffer", type=int, default=128, help="Serial receive buffer in bytes")
+    parser.add_argument("--bufsize", type=int, default=4, help="Marlin command slots (BUFSIZE)")
+    parser.add_argument("--planner", type=int, default=16, help="Planner depth in moves")
+    parser.add_argument("--min-segment-time", type=float, default=0.0, help="Shortest move in seconds")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Run this many times faster than real time")
+    args = parser.parse_args(argv)
+
+    controller = SimulatedController(args.firmware, args.baud, args.rx_buffer, args.bufsize, args.planner,
+                                     min_segment_time=args.min_segment_time, time_scale=args.time_scale)
+    device = serve_pty(controller)
+    print(f"Simulated {args.firmware} controller at {args.baud} baud on {device}")
+    print(f"Try: LASER_PORT={device} python lasersaw_1.py")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{controller.stats}")
+    except KeyboardInterrupt:
+        controller.close()
+
+
+if __name__ == "__main__":
+    main()
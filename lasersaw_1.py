@@ -1,17 +1,36 @@
-import serial
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
 from tkinter import simpledialog
-import subprocess
 import time
+import draw
+from connection import SerialConnection
+from gcode_sender import SenderThread, PowerChange, start_job, poll_events
+from port_broker import PortBroker
+from position_report import PositionReporter
+from machine_state import MachineState, machine_value
+from jog import Jogger, JOG_KEYS
+from realtime import PriorityLane
+from gcode_optimizer import optimize_gcode, OptimizerStats
+from gcode_file import read_gcode, sampled_progress, GcodeIndex, ResumeTracker
+from arc_fitting import fit_arcs, ArcFitStats
 
 
 class CNCControlApp:
+    # Shown in the status panel, so kept in self.machine, which tells the panel what changed
+    current_x = machine_value("x")
+    current_y = machine_value("y")
+    speed = machine_value("speed")
+    laser_power = machine_value("laser_power")
+
     def __init__(self, root):
         self.root = root
         self.root.title("CNC Control App")
+        self.machine = MachineState(self.root, x=0.0, y=0.0, speed=150, laser_power=1000,
+                                    connection="Disconnected", busy=False)
         
         # Initialize all necessary attributes before calling create_ui
         self.relative_mode = True
@@ -20,30 +39,69 @@ class CNCControlApp:
         self.current_x = 0.0
         self.current_y = 0.0
         self.laser_power = 1000
-
-        try:
-            self.setup_serial()
-        except Exception as e:
-            messagebox.showerror("Serial Connection Error", f"Failed to set up serial connection: {e}")
-            return  # Exit the initialization if serial setup fails
+        self.firmware = "marlin"
+        self.machine_width = 410  # mm; jogs stop at the bed's edge, and the draw tool starts with this size
+        self.machine_height = 860
+        self.arc_tolerance = 0.01  # mm fitted arcs may deviate from the original moves
+        self.job = None  # Job currently streamed by the sender thread
+        self.resume_point = None  # (file path, line) where an interrupted file job can pick up again
+        self.resume_index = None  # The interrupted job's GcodeIndex, with the modal state it saved on the way
+        self.tracker = None  # Maps streamed commands back to file lines for the current job
+        self.job_index = None  # GcodeIndex the current file job streams from
+        self.index_worker = None  # Thread rebuilding the modal state for a start line far into a file
+        self.power_interval = 0.1  # s between laser power updates from the wheel and PageUp/PageDown
+        self.power_timer = None
+        self.power_job = None
+        self.power_sent = None  # Last power value sent by send_laser_power
+        self.power_sent_at = 0.0
+
+        # The port is opened in the background once the UI is up (and again on
+        # the next command if the laser was off), so startup never waits on it
+        self.connection = SerialConnection()
+
+        # Abort, pause and resume skip the queue and go straight to the port
+        self.priority = PriorityLane(self.connection, self.firmware)
+
+        # All other writes go through the sender thread so the Tk mainloop never blocks on the port
+        self.sender = SenderThread(self.connection, firmware=self.firmware)
+        self.sender.start()
+        poll_events(self.root, self.sender)
+
+        # The draw tool sends its jobs through this process instead of opening the port itself
+        self.broker = PortBroker(self.root, self.sender, self.connection)
+        self.broker.listen()
 
         self.create_ui()  # Now it's safe to call create_ui
 
         # Bind keys and mouse actions
-        self.root.bind("<Left>", lambda event: self.move("left"))
-        self.root.bind("<Right>", lambda event: self.move("right"))
-        self.root.bind("<Up>", lambda event: self.move("up"))
-        self.root.bind("<Down>", lambda event: self.move("down"))
+        # Arrow keys jog continuously while held; the buttons still move one step
+        self.jogger = Jogger(self.root, self.sender, self.connection, self.firmware,
+                             machine_size=(self.machine_width, self.machine_height),
+                             position=lambda: (self.current_x, self.current_y))
+        for key in JOG_KEYS:
+            self.root.bind(f"<KeyPress-{key}>", self.jog_key_down)
+            self.root.bind(f"<KeyRelease-{key}>", lambda event: self.jogger.release(event.keysym))
+        self.root.bind("<FocusOut>", self.jog_focus_lost)
+        self.root.bind("<Escape>", self.abort)
         self.root.bind("<MouseWheel>", self.change_laser_power)
         self.root.bind("<Prior>", lambda event: self.change_laser_power(event, increment=10))
         self.root.bind("<Next>", lambda event: self.change_laser_power(event, increment=-10))
 
 
-        self.update_status_panel()
+        self.connection.connect()
+        # Position reports pushed by the firmware where it can, polled otherwise
+        self.reporter = PositionReporter(self.root, self.connection, self.sender, self.firmware)
+        self.reporter.start()
+        self.fetch_coordinates()
+        self.machine.subscribe(self.update_status_panel)
+        self.update_status_panel(set(self.machine.values))
 
 
     def open_draw_app(self):
-        subprocess.Popen(["python", "draw.py"])
+        # Opened in this process: no new interpreter, and it shares our port and settings
+        draw.open_window(self.root, self.sender, self.connection,
+                         settings={"firmware": self.firmware, "power": self.laser_power,
+                                   "machine_width": self.machine_width, "machine_height": self.machine_height})
 
     def create_ui(self):
         # Ensure all UI components including laser_power_entry are created here
@@ -52,17 +110,14 @@ class CNCControlApp:
 
 
 
-    def setup_serial(self):
-        self.serial_port = serial.Serial('COM3', 115200, timeout=1)
-        print("Serial port opened on COM3 with baud rate 115200.")
-        
     def send_gcode(self, x, y, laser_power):
         gcode_command = f"G1 X{x} Y{y} S{laser_power}"
         self.send_command(gcode_command)
 
     def send_home(self):
         gcode_home = "G28"  # Marlin G-code for homing
-        self.send_command(gcode_home)
+        if not self.send_command(gcode_home):
+            return
         # After homing, reset coordinates to 0,0,0
         self.current_x = 0.0
         self.current_y = 0.0
@@ -72,25 +127,110 @@ class CNCControlApp:
         mode_text = "Relative" if self.relative_mode else "Absolute"
         self.mode_button.config(text=f"Switch to {mode_text} Mode")
 
-    def abort(self):
-        self.send_command("M112")  # Send emergency stop command
+    def abort(self, event=None):
+        # Bound to the button going down (not up) and to Escape
+        requested = time.perf_counter()
+        latency = self.priority.send("abort", requested)  # Emergency stop, ahead of everything queued
+        self.sender.abort()  # Drop whatever is still queued
+        self.report_priority("Abort", latency)
+
+    def pause(self, event=None):
+        requested = time.perf_counter()
+        latency = self.priority.send("pause", requested)
+        if latency is not None and self.firmware != "grbl":
+            # M410 threw the planned moves away; stop streaming and make sure the laser is off
+            self.sender.abort(extra=self.priority.replies_due("pause"))
+            start_job(self.root, self.sender, ["M5"], name="Laser off")
+        self.report_priority("Pause", latency)
+
+    def resume(self, event=None):
+        requested = time.perf_counter()
+        if not self.priority.supports("resume"):
+            self.job_status.config(text="Resume: not possible on Marlin after a quick stop")
+            return
+        self.report_priority("Resume", self.priority.send("resume", requested))
+
+    def report_priority(self, name, latency):
+        if latency is None:
+            self.job_status.config(text=f"{name}: NOT SENT, no connection to the controller")
+            return
+        print(f"{name}: {self.priority.describe()}")
+        self.job_status.config(text=f"{name} sent: {self.priority.describe()}")
 
     def send_command(self, gcode_command):
+        # Manual commands are refused while a job runs: spliced into a program
+        # they would move the head mid-cut (and a trailing G90 would break a G91 program)
+        if self.sender.busy():
+            self.job_status.config(text="Busy: wait for the running job to finish, or abort it")
+            return False
         if self.relative_mode:
-            gcode_command = "G91\n" + gcode_command + "\nG90\n"  # Wrap the command with relative mode codes
-        
-            self.serial_port.write(gcode_command.encode() + b'\n')
-            self.serial_port.flush()
+            gcode_command = "G91\n" + gcode_command + "\nG90"  # Wrap the command with relative mode codes
+
+        start_job(self.root, self.sender, gcode_command.split("\n"), name="Command",
+                  on_done=self.job_finished)
+        return True
+
+    def send_job(self, gcode_lines, name, tracker=None, index=None):
+        # Returns False if refused because another job is running
+        if self.sender.busy():
+            messagebox.showwarning("Busy", f"{name}: wait for the running job to finish, or abort it.")
+            return False
+        # Drop zero-length moves and redundant laser toggles on the fly
+        self.optimizer_stats = OptimizerStats()
+        gcode_lines = optimize_gcode(gcode_lines, self.optimizer_stats)
+        if tracker is not None:
+            gcode_lines = tracker.number(gcode_lines)
+        self.arc_stats = None
+        if self.fit_arcs.get():
+            # Turn flattened curves back into G2/G3 arcs
+            self.arc_stats = ArcFitStats()
+            gcode_lines = fit_arcs(gcode_lines, tolerance=self.arc_tolerance, stats=self.arc_stats,
+                                   numbered=tracker is not None)
+        if tracker is not None:
+            gcode_lines = tracker.tag(gcode_lines)
+        self.tracker = tracker
+        self.job_index = index
+        gcode_lines = sampled_progress(gcode_lines, label="Queued")
+        # Stream the program unwrapped (files carry their own G90/G91) in the background
+        self.job = start_job(self.root, self.sender, gcode_lines, name=name,
+                             on_done=self.job_finished, on_progress=self.job_progress)
+        return True
+
+    def job_progress(self, job):
+        line = ""
+        if job is self.job and self.tracker is not None:
+            line = f", file line {self.tracker.resume_line(job.acked)}"
+        self.job_status.config(text=f"Job: {job.name} {job.sent}/{job.queued} lines{line}")
+
+    def job_finished(self, job):
+        if job is self.job:
+            print(self.optimizer_stats.describe())
+            if self.arc_stats is not None:
+                print(self.arc_stats.describe())
+            elapsed = job.finished - job.started
+            status = f"Job: {job.name} {job.state} ({job.sent} lines, {elapsed:.1f}s)"
+            if self.tracker is not None:
+                if job.state == "done":
+                    self.resume_point = None
+                    self.job_index.close()
+                else:
+                    # Remember where to pick up again; the index keeps that quick
+                    self.resume_point = (self.job_index.file_path, self.tracker.resume_line(job.acked))
+                    self.resume_index = self.job_index
+                    status += f", resume from line {self.resume_point[1]}"
+                self.job_index = None
+                self.tracker = None
+            self.job_status.config(text=status)
+        if job.state == "failed":
+            messagebox.showerror("Error", f"Error sending G-code: {job.error}")
 
 
     def open_gcode_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("G-code Files", "*.gcode")])
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    gcode_lines = f.readlines()
-                    for line in gcode_lines:
-                        self.send_command(line.strip())
+                # Read lazily while streaming instead of loading the whole file
+                self.send_job(read_gcode(file_path), name="File")
             except Exception as e:
                 messagebox.showerror("Error", f"Error opening or sending G-code file: {e}")
 
@@ -99,18 +239,85 @@ class CNCControlApp:
         file_path = filedialog.askopenfilename(filetypes=[("G-code Files", "*.gcode")])
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    gcode_lines = f.readlines()
-                    # Optionally, confirm before sending
-                    if messagebox.askyesno("Confirm", "Send this G-code to the machine?"):
-                        for line in gcode_lines:
-                            self.send_command(line.strip())
+                # Optionally, confirm before sending
+                if messagebox.askyesno("Confirm", "Send this G-code to the machine?"):
+                    # Offer to continue an interrupted run of the same file
+                    start_line = 1
+                    if self.resume_point and self.resume_point[0] == file_path:
+                        start_line = self.resume_point[1]
+                    start_line = simpledialog.askinteger("Start Line", "Start at line (1 = beginning):",
+                                                         initialvalue=start_line, minvalue=1)
+                    if start_line is None:
+                        return
+                    self.send_indexed_file(file_path, start_line)
             except Exception as e:
                 messagebox.showerror("Error", f"Error opening or sending G-code file: {e}")
 
 
 
 
+    def send_indexed_file(self, file_path, start_line):
+        # Memory-map the file and stream it from start_line, with the modal state
+        # (G90/G91, F, S, M3/M5) rebuilt from the lines before it
+        if self.sender.busy() or self.index_worker is not None:
+            messagebox.showwarning("Busy", f"File from line {start_line}: wait for the running job to finish, "
+                                           f"or abort it.")
+            return
+        index, self.resume_index = self.resume_index, None
+        if index is None or index.file_path != file_path or not index.unchanged():
+            if index is not None:
+                index.close()
+            index = GcodeIndex(file_path)
+        if index.state_known(start_line):
+            self.start_indexed_job(index, start_line)
+            return
+        # Far into a file this index has not read yet: every line before start_line
+        # has to be parsed, which takes seconds on a big file, so not on the Tk thread
+        self.job_status.config(text=f"Reading {file_path} up to line {start_line}...")
+        failed = []
+
+        def rebuild():
+            try:
+                index.state_before(start_line)
+            except Exception as e:
+                failed.append(e)
+
+        self.index_worker = threading.Thread(target=rebuild, name="gcode-index", daemon=True)
+        self.index_worker.start()
+        self.wait_for_index(failed, index, start_line)
+
+    def wait_for_index(self, failed, index, start_line):
+        if self.index_worker.is_alive():
+            self.root.after(50, self.wait_for_index, failed, index, start_line)
+            return
+        self.index_worker = None
+        if failed:
+            index.close()
+            self.job_status.config(text="")
+            messagebox.showerror("Error", f"Error reading {index.file_path}: {failed[0]}")
+            return
+        self.start_indexed_job(index, start_line)
+
+    def start_indexed_job(self, index, start_line):
+        tracker = ResumeTracker(index.resume_commands(start_line))
+        if not self.send_job(tracker.source(), name=f"File from line {start_line}", tracker=tracker, index=index):
+            # Another job got in while the file was read; keep what was read for the next try
+            if self.resume_index is not None:
+                self.resume_index.close()
+            self.resume_index = index
+            return
+        print(f"Streaming {index.file_path} from line {start_line}")
+
+    def jog_key_down(self, event):
+        if self.jogger.active is None and self.sender.busy():
+            return  # No jogging into a running job
+        self.jogger.press(event.keysym, self.speed)
+
+    def jog_focus_lost(self, event):
+        # The key release goes to whichever window has the focus now; stop as if it came
+        if self.jogger.active is not None:
+            self.jogger.release(self.jogger.active[0])
+
     def move(self, direction):
         gcode_command = ""
         if direction == "up":
@@ -144,25 +351,40 @@ class CNCControlApp:
         except ValueError:
             messagebox.showerror("Error", "Invalid laser power value. Please enter an integer between 0 and 255.")
             
-    def change_laser_power(self, event):
-        # Determine the direction of scroll (up or down)
-        if event.delta > 0:
-            # Scrolling up, increase laser power by 1
-            self.laser_power += 1
-        else:
-            # Scrolling down, decrease laser power by 1
-            self.laser_power -= 1
-
-        # Ensure laser power is within [0, 255]
-        self.laser_power = max(0, min(self.laser_power, 255))
-
-        # Update the laser power entry and send the new laser power command
+    def change_laser_power(self, event, increment=None):
+        # Wheel ticks step the power by 1, PageUp/PageDown by 10. The display
+        # follows every step; the controller gets only the latest value, at
+        # most once per power_interval
+        if increment is None:
+            increment = 1 if event.delta > 0 else -1
+
+        # Ensure laser power is within [0, 1000], the range set_laser_power accepts
+        self.laser_power = max(0, min(self.laser_power + increment, 1000))
+
+        # Update the laser power entry and schedule the update
         self.laser_power_entry.delete(0, tk.END)
         self.laser_power_entry.insert(0, str(self.laser_power))
-        self.send_command(f"S{self.laser_power}")
+        if self.power_timer is None:
+            delay = max(0.0, self.power_sent_at + self.power_interval - time.monotonic())
+            self.power_timer = self.root.after(int(delay * 1000), self.send_laser_power)
+
+    def send_laser_power(self):
+        self.power_timer = None
+        if self.power_job is not None and self.power_job.state == "running":
+            # The previous update is still queued; send the newest value once it is through
+            self.power_timer = self.root.after(int(self.power_interval * 1000), self.send_laser_power)
+            return
+        if self.laser_power == self.power_sent:
+            return
+        self.power_sent = self.laser_power
+        self.power_sent_at = time.monotonic()
+        # Not wrapped in G91/G90 like send_command. Goes ahead of the queued job
+        # lines; the sender picks the command the firmware takes at that point
+        self.power_job = start_job(self.root, self.sender, [PowerChange(self.laser_power)], name="Power",
+                                   interleave=True)
         
     def turn_laser_on(self):
-        self.send_command('M3')  # Turn on the laser
+        self.send_command(f"M3 S{self.laser_power}")  # Turn on the laser at the set power
 
     def turn_laser_off(self):
         self.send_command('M5')  # Turn off the laser
@@ -178,9 +400,8 @@ class CNCControlApp:
 
                 # Confirm before executing the cut
                 if messagebox.askyesno("Confirm Cut", f"Execute a {length}mm cut along the {axis}-axis at speed {self.speed} and laser power {self.laser_power}?"):
-                    self.send_command("M3 S" + str(self.laser_power))  # Optional: turn on the laser
-                    self.send_command(move_command)
-                    self.send_command("M5")  # Optional: turn off the laser after the cut
+                    # One job: laser on, cut, laser off
+                    self.send_command(f"M3 S{self.laser_power}\n{move_command}\nM5")
             else:
                 messagebox.showerror("Error", "Length must be greater than 0.")
         except ValueError:
@@ -204,7 +425,7 @@ class CNCControlApp:
             new_power = int(self.laser_power_entry.get())
             if 0 <= new_power <= 1000:
                 self.laser_power = new_power
-                self.send_command(f"S{self.laser_power}")
+                self.send_laser_power()  # Lands at once, even during a job
                 messagebox.showinfo("Success", f"Laser power set to {new_power}.")
             else:
                 messagebox.showerror("Error", "Laser power must be between 0 and 1000.")
@@ -213,39 +434,46 @@ class CNCControlApp:
 
 
     def fetch_coordinates(self):
-        # Example method to fetch and update coordinates
-        try:
-            response = self.serial_port.readline().decode().strip()
-            # Example response might be "X:123 Y:456"
-            parts = response.split()  # This will split by whitespace
-            x_part = parts[0]  # "X:123"
-            y_part = parts[1]  # "Y:456"
-    
-            # Parse the coordinate parts
-            self.current_x = float(x_part.split(':')[1])
-            self.current_y = float(y_part.split(':')[1])
-    
-            # Assuming connection status is good if we receive data
-            self.connected = True
-        except Exception as e:
-            self.connected = False
-            print("Failed to read or parse serial data:", e)
-    
-        # Schedule the next data fetch (if continuous updates are desired)
-        self.root.after(100, self.fetch_coordinates)
-    
-        # Update the status panel directly or schedule it to be updated
-        self.update_status_panel()
-
-
-
-    def update_status_panel(self):
-        # Schedule this method to be called again after 100 milliseconds
-        self.connection_status.config(text="Connection: Connected")
-        self.current_coords.config(text=f"Coordinates: X={self.current_x:.2f} Y={self.current_y:.2f}")
-        self.current_speed.config(text=f"Speed: {self.speed} units/min")
-        self.laser_power_status.config(text=f"Laser Power: {self.laser_power}")
-        self.root.after(100, self.update_status_panel)
+        # Handle what the reader thread has sorted out of the controller's
+        # replies since the last call; never waits on the port
+        while True:
+            try:
+                reply = self.connection.events.get_nowait()
+            except queue.Empty:
+                break
+            if reply.kind == "position":
+                self.machine.set(x=reply.position[0], y=reply.position[1])
+                self.connected = True
+                self.reporter.position_seen()
+            elif reply.kind in ("error", "alarm"):
+                self.job_status.config(text=f"Controller: {reply.text}")
+            elif reply.kind == "closed":
+                self.connected = False
+        self.machine.set(connection=self.connection.describe(), busy=self.sender.busy())
+
+        # Schedule the next check
+        self.root.after(50, self.fetch_coordinates)
+
+
+
+    def update_status_panel(self, changed):
+        # Called by self.machine with the names of the values that changed;
+        # only those labels are redrawn
+        if "connection" in changed:
+            self.connection_status.config(text=f"Connection: {self.machine['connection']}")
+        if "x" in changed or "y" in changed:
+            self.current_coords.config(text=f"Coordinates: X={self.current_x:.2f} Y={self.current_y:.2f}")
+        if "speed" in changed:
+            self.current_speed.config(text=f"Speed: {self.speed} units/min")
+        if "laser_power" in changed:
+            self.laser_power_status.config(text=f"Laser Power: {self.laser_power}")
+        if "busy" in changed:
+            # Manual controls are off while a job runs (power and abort/pause stay live)
+            state = "disabled" if self.machine["busy"] else "normal"
+            for button in (self.send_button, self.home_button, self.open_file_button, self.up_button,
+                           self.down_button, self.left_button, self.right_button, self.z_plus_button,
+                           self.z_minus_button, self.cut_x_button, self.cut_y_button, self.send_gcode_button):
+                button.config(state=state)
 
 
     def create_ui(self):
@@ -271,7 +499,11 @@ class CNCControlApp:
         self.down_button = ttk.Button(self.root, text="Y-Down", command=lambda: self.move("down"))
         self.left_button = ttk.Button(self.root, text="X-Left", command=lambda: self.move("left"))
         self.right_button = ttk.Button(self.root, text="X+Right", command=lambda: self.move("right"))
-        self.abort_button = ttk.Button(self.root, text="Abort", command=self.abort)
+        # Abort fires on press; waiting for the release would add the whole click to the stop time
+        self.abort_button = ttk.Button(self.root, text="Abort")
+        self.abort_button.bind("<ButtonPress-1>", self.abort)
+        self.pause_button = ttk.Button(self.root, text="Pause", command=self.pause)
+        self.resume_button = ttk.Button(self.root, text="Resume", command=self.resume)
 
 
         self.up_button.pack(pady=5)
@@ -280,6 +512,8 @@ class CNCControlApp:
         self.right_button.pack(pady=5)
         self.step_button.pack(pady=5)
         self.abort_button.pack(pady=5)
+        self.pause_button.pack(pady=5)
+        self.resume_button.pack(pady=5)
         self.speed_button.pack(pady=5)
         
         
@@ -339,12 +573,20 @@ class CNCControlApp:
 
         self.laser_power_status = ttk.Label(self.status_frame, text=f"Laser Power: {self.laser_power}")
         self.laser_power_status.pack(side='top', fill='x')
+
+        self.job_status = ttk.Label(self.status_frame, text="Job: Idle")
+        self.job_status.pack(side='top', fill='x')
         self.open_file_button = ttk.Button(self.root, text="Open G-code File", command=self.open_gcode_file)
         self.open_file_button.pack(pady=5)
         
         self.send_gcode_button = ttk.Button(self.root, text="Send G-code to Machine", command=self.open_and_send_gcode)
         self.send_gcode_button.pack(pady=10)
 
+        # Optional: fit G2/G3 arcs to chord runs in loaded files
+        self.fit_arcs = tk.BooleanVar(value=False)
+        self.fit_arcs_check = ttk.Checkbutton(self.root, text="Fit arcs to curves in loaded files", variable=self.fit_arcs)
+        self.fit_arcs_check.pack(pady=5)
+
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,48 @@
+import time
+
+# Values shown by the status panel, with change notification. set() only
+# records what actually changed; observers are called once with every name
+# changed since the last call, at most once per display frame, so a burst of
+# position reports costs one redraw and an idle machine costs none.
+
+DISPLAY_INTERVAL = 1 / 60  # s; no point redrawing faster than the screen
+
+
+class MachineState:
+    def __init__(self, root, interval=DISPLAY_INTERVAL, **values):
+        self.root = root  # set() must be called on the Tk thread
+        self.interval = interval
+        self.values = dict(values)
+        self.changed = set()
+        self.observers = []
+        self.scheduled = False
+        self.last_notify = 0.0
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def subscribe(self, callback):
+        # callback(changed_names) runs on the Tk thread
+        self.observers.append(callback)
+
+    def set(self, **values):
+        for name, value in values.items():
+            if self.values.get(name) != value:
+                self.values[name] = value
+                self.changed.add(name)
+        if self.changed and not self.scheduled:
+            self.scheduled = True
+            delay = max(0.0, self.last_notify + self.interval - time.monotonic())
+            self.root.after(int(delay * 1000), self.notify)
+
+    def notify(self):
+        self.scheduled = False
+        self.last_notify = time.monotonic()
+        changed, self.changed = self.changed, set()
+        for callback in self.observers:
+            callback(changed)
+
+
+def machine_value(name):
+    # Class attribute that reads and writes `name` in the instance's self.machine
+    return property(lambda self: self.machine[name], lambda self, value: self.machine.set(**{name: value}))
@@ -0,0 +1,307 @@
+import math
+import time
+from collections import namedtuple
+
+# Orders cut paths so the head spends as little time as possible travelling
+# with the laser off. A path is a list of (x, y) points cut from first to last;
+# any path may be cut backwards. A point may also be an ArcPoint, meaning the
+# head gets there along an arc around (cx, cy) instead of a straight line.
+
+ArcPoint = namedtuple("ArcPoint", "x y cx cy clockwise")
+
+
+def reverse_path(path):
+    # The same path cut from its last point to its first; arcs change direction
+    # and their centre moves to the point where they now end
+    reversed_path = [(path[-1][0], path[-1][1])]
+    for k in range(len(path) - 1, 0, -1):
+        x, y = path[k - 1][0], path[k - 1][1]
+        arrival = path[k]
+        if isinstance(arrival, ArcPoint):
+            reversed_path.append(ArcPoint(x, y, arrival.cx, arrival.cy, not arrival.clockwise))
+        else:
+            reversed_path.append((x, y))
+    return reversed_path
+
+
+def circle_path(cx, cy, r, clockwise=True):
+    # Full circle starting and ending at its rightmost point
+    return [(cx + r, cy), ArcPoint(cx + r, cy, cx, cy, clockwise)]
+
+
+def dist(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def travel_distance(paths, start=(0.0, 0.0)):
+    # Laser-off distance needed to cut the paths in the given order
+    total = 0.0
+    position = start
+    for path in paths:
+        total += dist(position, path[0])
+        position = path[-1]
+    return total
+
+
+class SpatialGrid:
+    # Uniform grid over path endpoints. Items are (path index, end) where end 0
+    # is the path's first point and end 1 its last point.
+    def __init__(self, paths):
+        self.paths = paths
+        xs = [p[0] for path in paths for p in (path[0], path[-1])]
+        ys = [p[1] for path in paths for p in (path[0], path[-1])]
+        self.min_x, self.min_y = min(xs), min(ys)
+        width = max(xs) - self.min_x
+        height = max(ys) - self.min_y
+        # Aim for about two endpoints per cell
+        self.cell = max(math.sqrt(max(width * height, 1e-9) / max(len(paths), 1)), 1e-6)
+        self.max_ring = int(max(width, height) / self.cell) + 2
+        self.cells = {}
+        for index, path in enumerate(paths):
+            for end in (0, 1):
+                self.cells.setdefault(self.key(self.point((index, end))), []).append((index, end))
+
+    def point(self, item):
+        index, end = item
+        return self.paths[index][-1 if end else 0]
+
+    def key(self, point):
+        return (int((point[0] - self.min_x) // self.cell), int((point[1] - self.min_y) // self.cell))
+
+    def ring(self, centre, r):
+        cx, cy = centre
+        if r == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in range(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def remove_path(self, index):
+        for end in (0, 1):
+            self.cells[self.key(self.point((index, end)))].remove((index, end))
+
+    def nearest(self, point):
+        # Closest remaining endpoint, or None when the grid is empty
+        centre = self.key(point)
+        best = None
+        best_d = math.inf
+        for r in range(self.max_ring + 1 + abs(centre[0]) + abs(centre[1])):
+            for key in self.ring(centre, r):
+                for item in self.cells.get(key, ()):
+                    d = dist(point, self.point(item))
+                    if d < best_d:
+                        best, best_d = item, d
+            # Everything in the next ring is at least r cells away
+            if best is not None and best_d <= r * self.cell:
+                break
+        return best
+
+    def near(self, point, count):
+        # Roughly the `count` closest endpoints to point
+        centre = self.key(point)
+        found = []
+        for r in range(self.max_ring + 1 + abs(centre[0]) + abs(centre[1])):
+            for key in self.ring(centre, r):
+                found.extend(self.cells.get(key, ()))
+            if len(found) >= count:
+                break
+        found.sort(key=lambda item: dist(point, self.point(item)))
+        return found[:count]
+
+
+def chain_segments(segments, precision=3):
+    # Join segments that share endpoints into continuous polylines, so each
+    # polyline is cut in one go. Endpoints are matched after rounding to
+    # `precision` decimals; closed shapes come back with first == last point.
+    def key(point):
+        return (round(point[0], precision), round(point[1], precision))
+
+    segments = [segment for segment in segments if key(segment[0]) != key(segment[-1])]
+    at = {}  # Endpoint -> indices of segments touching it
+    for index, segment in enumerate(segments):
+        at.setdefault(key(segment[0]), []).append(index)
+        at.setdefault(key(segment[-1]), []).append(index)
+    used = [False] * len(segments)
+
+    def take(point):
+        # Unused segment leaving point, oriented to start there
+        for index in at[key(point)]:
+            if not used[index]:
+                used[index] = True
+                segment = segments[index]
+                return segment if key(segment[0]) == key(point) else segment[::-1]
+        return None
+
+    # Start at dead ends first so open chains are not split in the middle
+    order = sorted(range(len(segments)),
+                   key=lambda i: min(len(at[key(segments[i][0])]), len(at[key(segments[i][-1])])) != 1)
+    paths = []
+    for index in order:
+        if used[index]:
+            continue
+        used[index] = True
+        segment = segments[index]
+        if len(at[key(segment[-1])]) == 1:
+            segment = segment[::-1]  # Walk away from the dead end
+        path = list(segment)
+        while True:
+            following = take(path[-1])
+            if following is None:
+                break
+            path.extend(following[1:])
+        while key(path[0]) != key(path[-1]):
+            preceding = take(path[0])
+            if preceding is None:
+                break
+            path[:0] = preceding[::-1][:-1]
+        paths.append(path)
+    return paths
+
+
+def nearest_neighbour(paths, start):
+    # Greedy seed tour: always cut the closest remaining path next, entering it
+    # from whichever end is nearer
+    grid = SpatialGrid(paths)
+    tour = []
+    position = start
+    for _ in range(len(paths)):
+        index, end = grid.nearest(position)
+        grid.remove_path(index)
+        reverse = end == 1
+        tour.append((index, reverse))
+        path = paths[index]
+        position = path[0] if reverse else path[-1]
+    return tour
+
+
+class Tour:
+    # Path order with orientation, kept as parallel lists of entry and exit points
+    def __init__(self, paths, order, start):
+        self.start = start
+        self.ids = [index for index, _ in order]
+        self.reversed = [reverse for _, reverse in order]
+        self.entry = [paths[i][-1] if r else paths[i][0] for i, r in order]
+        self.exit = [paths[i][0] if r else paths[i][-1] for i, r in order]
+        self.pos = [0] * len(paths)
+        self.reindex(0, len(order) - 1)
+
+    def reindex(self, i, j):
+        for k in range(i, j + 1):
+            self.pos[self.ids[k]] = k
+
+    def before(self, k):
+        return self.start if k == 0 else self.exit[k - 1]
+
+    def gap(self, a, k):
+        # Travel from point a to the entry of position k (nothing after the last path)
+        return dist(a, self.entry[k]) if k < len(self.ids) else 0.0
+
+    def reverse(self, i, j):
+        # Cut positions i..j in the opposite order, each path backwards
+        for name in ("ids", "reversed", "entry", "exit"):
+            values = getattr(self, name)
+            values[i:j + 1] = values[i:j + 1][::-1]
+        self.entry[i:j + 1], self.exit[i:j + 1] = self.exit[i:j + 1], self.entry[i:j + 1]
+        self.reversed[i:j + 1] = [not r for r in self.reversed[i:j + 1]]
+        self.reindex(i, j)
+
+    def move(self, i, length, k, flip):
+        # Move the block at positions i..i+length-1 so it is cut right before position k
+        block = [values[i:i + length] for values in (self.ids, self.reversed, self.entry, self.exit)]
+        if flip:
+            ids, rev, entry, exit_ = (values[::-1] for values in block)
+            block = [ids, [not r for r in rev], exit_, entry]
+        for values in (self.ids, self.reversed, self.entry, self.exit):
+            del values[i:i + length]
+        if k > i:
+            k -= length
+        for values, part in zip((self.ids, self.reversed, self.entry, self.exit), block):
+            values[k:k] = part
+        self.reindex(min(i, k), max(i + length, k + length) - 1)
+
+
+def two_opt(tour, grid, deadline, neighbours=8):
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(len(tour.ids)):
+            a = tour.before(i)
+            old_i = dist(a, tour.entry[i])
+            for index, end in grid.near(a, neighbours):
+                j = tour.pos[index]
+                # The candidate point has to become the new entry, i.e. be the exit of j
+                if j <= i or (end == 1) == tour.reversed[j]:
+                    continue
+                delta = (dist(a, tour.exit[j]) + tour.gap(tour.entry[i], j + 1)
+                         - old_i - tour.gap(tour.exit[j], j + 1))
+                if delta < -1e-9:
+                    tour.reverse(i, j)
+                    improved = True
+                    break
+            if time.monotonic() > deadline:
+                return
+
+
+def or_opt(tour, grid, deadline, neighbours=8, max_block=3):
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for length in range(1, max_block + 1):
+            i = 0
+            while i + length <= len(tour.ids):
+                last = i + length - 1
+                a = tour.before(i)
+                removal_gain = (dist(a, tour.entry[i]) + tour.gap(tour.exit[last], last + 1)
+                                - tour.gap(a, last + 1))
+                best = None
+                for point in (tour.entry[i], tour.exit[last]):
+                    for index, _ in grid.near(point, neighbours):
+                        m = tour.pos[index]
+                        for k in (m, m + 1):
+                            if i <= k <= last + 1:
+                                continue
+                            b = tour.before(k)
+                            for flip in (False, True):
+                                first, final = ((tour.exit[last], tour.entry[i]) if flip
+                                                else (tour.entry[i], tour.exit[last]))
+                                cost = dist(b, first) + tour.gap(final, k) - tour.gap(b, k)
+                                gain = removal_gain - cost
+                                if gain > 1e-9 and (best is None or gain > best[0]):
+                                    best = (gain, k, flip)
+                if best is not None:
+                    tour.move(i, length, best[1], best[2])
+                    improved = True
+                i += 1
+                if time.monotonic() > deadline:
+                    return
+
+
+def order_paths(paths, start=(0.0, 0.0), improve=True, time_limit=1.0):
+    # Returns the reordered (and possibly reversed) paths plus travel statistics
+    paths = [list(path) for path in paths if path]
+    before = travel_distance(paths, start)
+    if not paths:
+        return [], {"paths": 0, "travel_before": 0.0, "travel_after": 0.0, "travel_saved": 0.0}
+
+    tour = Tour(paths, nearest_neighbour(paths, start), start)
+    if improve and len(paths) > 2:
+        deadline = time.monotonic() + time_limit
+        grid = SpatialGrid(paths)
+        two_opt(tour, grid, deadline)
+        or_opt(tour, grid, deadline)
+
+    ordered = [reverse_path(paths[i]) if r else paths[i] for i, r in zip(tour.ids, tour.reversed)]
+    after = travel_distance(ordered, start)
+    return ordered, {"paths": len(paths), "travel_before": before,
+                     "travel_after": after, "travel_saved": before - after}
+
+
+def describe_travel(stats):
+    before = stats["travel_before"]
+    percent = 100.0 * stats["travel_saved"] / before if before else 0.0
+    return (f"Travel {before:.0f}mm -> {stats['travel_after']:.0f}mm "
+            f"(saved {stats['travel_saved']:.0f}mm, {percent:.0f}%)")
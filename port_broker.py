@@ -0,0 +1,317 @@
+import hmac
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+
+from gcode_sender import SenderJob, StreamError, JOB_END
+
+# Lets several tools share the one serial port. The controller (lasersaw_1.py)
+# owns the port and its sender thread and runs a PortBroker on localhost; a
+# draw tool started as a separate process connects with connect_broker() and
+# gets a RemoteSender, which start_job/poll_events use like a SenderThread.
+# Every job ends up in the controller's single command queue.
+#
+# Any local process (or a web page posting to localhost) can reach the port,
+# so the first line of every connection must be HELLO <token>, with the
+# token the broker writes to TOKEN_FILE (readable by the user only) each time
+# it starts. Anything else, then or later, drops the connection.
+#
+# Protocol, one UTF-8 text line per message:
+#   client -> broker: HELLO <token> (first line only)
+#                     | JOB <id> <name> | LINE <id> <command> | END <id> | FAIL <id> <message>
+#                     | ABORT (sent on a fresh connection so it never queues behind lines)
+#   broker -> client: PROGRESS <id> <sent> <acked> | DONE <id> <state> <sent> <acked> <error>
+#                     | STATUS <connection state>
+
+BROKER_HOST = "127.0.0.1"  # Never listen beyond this machine
+BROKER_PORT = 50007
+TOKEN_FILE = os.path.join(os.path.expanduser("~"), ".laser_saw_broker")
+HELLO_TIMEOUT = 2.0  # s a new connection gets to send its HELLO
+
+
+class PortBroker(threading.Thread):
+    def __init__(self, root, sender, connection, host=BROKER_HOST, port=BROKER_PORT):
+        super().__init__(name="port-broker", daemon=True)
+        self.root = root
+        self.sender = sender
+        self.connection = connection
+        self.address = (host, port)
+        self.server = None
+        self.clients = []  # (socket, lock) of connected tools
+        self.status = None
+        self.token = secrets.token_hex(16)
+        self.lock = threading.Lock()
+
+    def listen(self):
+        # Returns False if another controller already owns the address
+        try:
+            self.server = socket.create_server(self.address)
+            write_token(self.token)  # Only once the address is ours, or the running controller's token is lost
+        except OSError as e:
+            print(f"Port broker not started on {self.address[0]}:{self.address[1]}: {e}")
+            if self.server is not None:
+                self.server.close()
+            return False
+        self.start()
+        self.poll_status()
+        return True
+
+    def run(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break  # Server socket closed
+            threading.Thread(target=self.serve, args=(client,), name="port-broker-client", daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def send(self, client, message):
+        sock, lock = client
+        try:
+            with lock:
+                sock.sendall((message + "\n").encode())
+        except OSError:
+            pass  # Client went away; serve() cleans up
+
+    def hello(self, sock, reader):
+        # True if the client's first line carries this session's token
+        sock.settimeout(HELLO_TIMEOUT)
+        try:
+            kind, _, token = reader.readline(200).rstrip("\r\n").partition(" ")
+        except (OSError, UnicodeDecodeError):
+            return False
+        sock.settimeout(None)
+        return kind == "HELLO" and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def serve(self, sock):
+        reader = sock.makefile("r", encoding="utf-8", newline="\n")
+        if not self.hello(sock, reader):
+            sock.close()
+            return
+        client = (sock, threading.Lock())
+        with self.lock:
+            self.clients.append(client)
+        self.send(client, f"STATUS {self.connection.describe()}")
+        jobs = {}
+        try:
+            for raw in reader:
+                kind, _, rest = raw.rstrip("\r\n").partition(" ")
+                if kind not in ("JOB", "LINE", "END", "FAIL", "ABORT"):
+                    break
+                if kind == "ABORT":
+                    self.sender.abort()
+                    continue
+                job_id, _, rest = rest.partition(" ")
+                if kind == "JOB":
+                    if self.sender.busy():
+                        # Its lines would be spliced into the running job
+                        self.send(client, f"DONE {job_id} failed 0 0 The controller is running another job")
+                        continue
+                    job = SenderJob(rest or "Remote job", on_done=self.job_done(client, job_id),
+                                    on_progress=self.job_progress(client, job_id))
+                    jobs[job_id] = job
+                    self.sender.submit(job)
+                    continue
+                job = jobs.get(job_id)
+                if job is None or job.state != "running":
+                    continue
+                if kind == "LINE":
+                    # Blocks while the sender's queue is full, which holds back the client too
+                    self.sender.commands.put((job, rest))
+                    job.queued += 1
+                elif kind == "END":
+                    self.sender.commands.put((job, JOB_END))
+                    job.fed_all = True
+                elif kind == "FAIL":
+                    self.sender.fail(job, StreamError(rest))
+        except (OSError, UnicodeDecodeError):
+            pass
+        finally:
+            with self.lock:
+                self.clients.remove(client)
+            sock.close()
+            # A job the tool never finished sending cannot complete
+            for job in jobs.values():
+                if job.state == "running" and not job.fed_all:
+                    self.sender.fail(job, StreamError("Client disconnected"))
+
+    def job_progress(self, client, job_id):
+        def progress(job):
+            self.send(client, f"PROGRESS {job_id} {job.sent} {job.acked}")
+        return progress
+
+    def job_done(self, client, job_id):
+        def done(job):
+            error = str(job.error or "").replace("\n", " ")
+            self.send(client, f"DONE {job_id} {job.state} {job.sent} {job.acked} {error}")
+        return done
+
+    def poll_status(self, interval=500):
+        # Tell the tools when the controller's connection changes
+        status = self.connection.describe()
+        if status != self.status:
+            self.status = status
+            with self.lock:
+                clients = list(self.clients)
+            for client in clients:
+                self.send(client, f"STATUS {status}")
+        self.root.after(interval, self.poll_status, interval)
+
+
+class RemoteSender(threading.Thread):
+    # Client side of the broker with the parts of SenderThread that start_job,
+    # poll_events and the abort buttons use
+    def __init__(self, sock, token, queue_size=500):
+        super().__init__(name="port-broker-sender", daemon=True)
+        self.sock = sock
+        self.token = token
+        self.address = sock.getpeername()
+        self.commands = queue.Queue(maxsize=queue_size)
+        self.events = queue.Queue()
+        self.jobs = {}  # id -> SenderJob still running
+        self.next_id = 0
+        self.status = "Waiting for controller"
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        threading.Thread(target=self.read_replies, name="port-broker-replies", daemon=True).start()
+
+    def write(self, message):
+        with self.write_lock:
+            self.sock.sendall((message + "\n").encode())
+
+    def submit(self, job):
+        with self.lock:
+            self.next_id += 1
+            job.remote_id = str(self.next_id)
+            self.jobs[job.remote_id] = job
+        self.write(f"JOB {job.remote_id} {job.name}")
+
+    def busy(self):
+        # Only this tool's jobs; the controller refuses a job while it runs one of its own
+        with self.lock:
+            return any(not job.interleave for job in self.jobs.values())
+
+    def put_priority(self, item):
+        # Sent in order; it is the controller's sender that puts lines ahead of others
+        self.commands.put_nowait(item)
+
+    def run(self):
+        while True:
+            job, command = self.commands.get()
+            if job.state != "running":
+                continue
+            try:
+                if command is JOB_END:
+                    self.write(f"END {job.remote_id}")
+                else:
+                    self.write(f"LINE {job.remote_id} {command}")
+            except OSError as e:
+                self.finish(job, "failed", e)
+
+    def read_replies(self):
+        try:
+            for raw in self.sock.makefile("r", encoding="utf-8", newline="\n"):
+                kind, _, rest = raw.rstrip("\r\n").partition(" ")
+                if kind == "STATUS":
+                    self.status = rest
+                    continue
+                fields = rest.split(" ", 4)
+                with self.lock:
+                    job = self.jobs.get(fields[0])
+                if job is None:
+                    continue
+                if kind == "PROGRESS":
+                    job.sent, job.acked = int(fields[1]), int(fields[2])
+                    self.events.put(("progress", job))
+                elif kind == "DONE":
+                    job.sent, job.acked = int(fields[2]), int(fields[3])
+                    self.finish(job, fields[1], StreamError(fields[4]) if fields[1] == "failed" else None)
+        except OSError:
+            pass
+        self.status = "Controller closed"
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            self.finish(job, "failed", StreamError("Lost the connection to the controller"))
+
+    def finish(self, job, state, error=None):
+        with self.lock:
+            if self.jobs.pop(job.remote_id, None) is None:
+                return  # Already reported
+        job.state = state
+        job.error = error
+        job.finished = time.monotonic()
+        self.events.put((state, job))
+
+    def fail(self, job, error):
+        try:
+            self.write(f"FAIL {job.remote_id} {str(error).replace(chr(10), ' ')}")
+        except OSError:
+            pass
+        self.finish(job, "failed", error)
+
+    def abort(self):
+        # Aborts every job on the controller, like its own Abort button
+        with self.lock:
+            jobs, self.jobs = list(self.jobs.values()), {}
+        for job in jobs:
+            job.state = "aborted"
+            job.finished = time.monotonic()
+            self.events.put(("aborted", job))
+        while True:
+            try:
+                self.commands.get_nowait()
+            except queue.Empty:
+                break
+        # On a connection of its own: the job connection may be stuck behind
+        # lines the broker cannot queue yet
+        try:
+            with socket.create_connection(self.address, timeout=1) as sock:
+                sock.sendall(f"HELLO {self.token}\nABORT\n".encode())
+        except OSError as e:
+            print("Could not reach the controller to abort:", e)
+
+    def connect(self):
+        pass  # The controller opens the port
+
+    def describe(self):
+        return f"Via controller: {self.status}"
+
+
+def write_token(token):
+    # Replaced, not rewritten, so the file is always new and private to the user
+    try:
+        os.remove(TOKEN_FILE)
+    except FileNotFoundError:
+        pass
+    fd = os.open(TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+
+
+def read_token():
+    try:
+        with open(TOKEN_FILE, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def connect_broker(host=BROKER_HOST, port=BROKER_PORT, timeout=0.5):
+    # RemoteSender connected to a running controller, or None if there is none
+    token = read_token()
+    if not token:
+        return None
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.sendall(f"HELLO {token}\n".encode())
+    except OSError:
+        return None
+    sock.settimeout(None)
+    return RemoteSender(sock, token)
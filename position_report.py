@@ -0,0 +1,63 @@
+import time
+
+from gcode_sender import start_job
+
+# Keeps position reports coming without putting queries in the job queue:
+#   GRBL:   the real-time '?' status request, written straight to the port
+#   Marlin: M154 position auto-report (AUTO_REPORT_POSITION, Marlin 2.0.9+),
+#           switched on once per connection
+# When a Marlin build does not auto-report, fall back to M114 polling, only
+# while no job is running so queries never queue behind a dense job.
+
+GRBL_STATUS_INTERVAL = 0.2  # s; GRBL recommends at most 5 status requests a second
+MARLIN_AUTO_REPORT = 1  # s between M154 reports (whole seconds only)
+POLL_INTERVAL = 0.5  # s between M114 when polling
+AUTO_REPORT_GRACE = 3.0  # s without a report before M154 is taken as unsupported
+
+
+class PositionReporter:
+    def __init__(self, root, connection, sender, firmware="marlin"):
+        self.root = root
+        self.connection = connection
+        self.sender = sender
+        self.firmware = firmware
+        self.serial_port = None  # Port the current mode was set up for
+        self.mode = None  # "realtime", "auto" or "poll"
+        self.last_report = 0.0
+        self.last_request = 0.0
+
+    def position_seen(self):
+        # Called for every position report that reaches the UI
+        self.last_report = time.monotonic()
+
+    def start(self):
+        self.tick()
+
+    def tick(self):
+        now = time.monotonic()
+        serial_port = self.connection.serial_port
+        if serial_port is None:
+            self.serial_port = self.mode = None
+        elif serial_port is not self.serial_port:
+            # New connection: subscribe to reports
+            self.serial_port = serial_port
+            self.last_report = now
+            if self.firmware == "grbl":
+                self.mode = "realtime"
+            else:
+                self.mode = "auto"
+                start_job(self.root, self.sender, [f"M154 S{MARLIN_AUTO_REPORT}"], name="Auto-report",
+                          interleave=True)
+        elif self.mode == "realtime":
+            if now - self.last_request >= GRBL_STATUS_INTERVAL:
+                self.last_request = now
+                self.connection.write_realtime(b"?")
+        elif self.mode == "auto":
+            if now - self.last_report > AUTO_REPORT_GRACE + MARLIN_AUTO_REPORT:
+                print("No position auto-report (M154) from the controller; polling with M114")
+                self.mode = "poll"
+        elif self.mode == "poll":
+            if now - self.last_request >= POLL_INTERVAL and not self.sender.jobs:
+                self.last_request = now
+                start_job(self.root, self.sender, ["M114"], name="Position", interleave=True)
+        self.root.after(50, self.tick)
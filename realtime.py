@@ -0,0 +1,54 @@
+import time
+
+# Commands that must never wait behind anything: written straight to the
+# port from the Tk thread, past the job queue, the streamer's buffer
+# accounting and the planner.
+#   GRBL:   real-time bytes, acted on the moment they arrive
+#           (0x18 soft reset, ! feed hold, ~ cycle start)
+#   Marlin: M112 (kill) and M410 (quick stop: halts and drops all planned
+#           moves, so there is nothing to resume). Marlin acts on these as
+#           they arrive only when built with EMERGENCY_PARSER, the default on
+#           32-bit boards; otherwise they wait in its serial buffer.
+REALTIME_COMMANDS = {
+    "grbl": {"abort": b"\x18", "pause": b"!", "resume": b"~"},
+    "marlin": {"abort": b"M112\n", "pause": b"M410\n"},
+}
+
+# Marlin also queues the line and answers it with 'ok' like any other
+# (M112 halts it before it gets that far)
+ANSWERED = {"grbl": set(), "marlin": {"pause"}}
+
+
+class PriorityLane:
+    def __init__(self, connection, firmware="marlin"):
+        self.connection = connection
+        self.firmware = firmware
+        self.count = 0
+        self.last = None  # s from request to write of the last command
+        self.worst = 0.0
+
+    def supports(self, action):
+        return action in REALTIME_COMMANDS[self.firmware]
+
+    def send(self, action, requested=None):
+        # requested: time.perf_counter() when the button went down. Returns the
+        # latency to the write in seconds, or None if nothing could be written.
+        if requested is None:
+            requested = time.perf_counter()
+        data = REALTIME_COMMANDS[self.firmware].get(action)
+        if data is None or not self.connection.write_realtime(data):
+            return None
+        self.last = time.perf_counter() - requested
+        self.worst = max(self.worst, self.last)
+        self.count += 1
+        return self.last
+
+    def replies_due(self, action):
+        # Byte lengths of the 'ok's the sender must still expect for `action`
+        if action in ANSWERED[self.firmware]:
+            return [len(REALTIME_COMMANDS[self.firmware][action])]
+        return []
+
+    def describe(self):
+        return (f"{self.last * 1000:.2f} ms from press to write "
+                f"(worst {self.worst * 1000:.2f} ms over {self.count})")
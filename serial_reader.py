@@ -0,0 +1,81 @@
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+
+# Everything the controller sends is read by one thread and sorted into typed
+# replies. Acknowledgements go to the streamer (replies queue), everything
+# else to whoever shows the machine state (events queue), so position reports
+# and job replies no longer get in each other's way.
+#
+# kind is "ok", "error", "alarm", "position", "reset" (start-up banner: the
+# controller restarted and forgot every line it had), "message" or "closed"
+# (port gone).
+# position is (x, y, z) for position reports; state is GRBL's machine state
+# ("Idle", "Run", "Hold:0", ...) when it came with a status report.
+Reply = namedtuple("Reply", "kind text position state")
+
+# Marlin M114 / M154: "X:10.00 Y:20.00 Z:0.00 E:0.00 Count X:800 Y:1600 Z:0"
+MARLIN_POSITION = re.compile(r"X:(-?\d+\.?\d*)\s*Y:(-?\d+\.?\d*)(?:\s*Z:(-?\d+\.?\d*))?")
+
+
+def parse_grbl_status(line):
+    # "<Idle|MPos:1.000,2.000,0.000|FS:0,0>" -> ((1.0, 2.0, 0.0), "Idle")
+    fields = line.strip("<>").split("|")
+    for field in fields[1:]:
+        if field.startswith(("MPos:", "WPos:")):
+            values = [float(v) for v in field[5:].split(",")]
+            return (values + [0.0, 0.0, 0.0])[:3], fields[0]
+    return None, fields[0]
+
+
+def classify(line):
+    lower = line.lower()
+    if lower.startswith("ok"):
+        return Reply("ok", line, None, None)
+    if lower.startswith("alarm") or lower.startswith("!!") or "printer halted" in lower:
+        return Reply("alarm", line, None, None)  # Marlin M112: "Error:Printer halted. kill() called!"
+    if lower.startswith("error"):
+        return Reply("error", line, None, None)
+    if line.startswith("Grbl ") or lower == "start":
+        return Reply("reset", line, None, None)
+    if line.startswith("<") and line.endswith(">"):
+        position, state = parse_grbl_status(line)
+        if position is not None:
+            return Reply("position", line, tuple(position), state)
+        return Reply("message", line, None, state)
+    match = MARLIN_POSITION.match(line)
+    if match:
+        x, y, z = match.groups()
+        return Reply("position", line, (float(x), float(y), float(z or 0.0)), None)
+    return Reply("message", line, None, None)  # 'echo:', 'busy:', start-up banner, ...
+
+
+class SerialReader(threading.Thread):
+    def __init__(self, serial_port, events):
+        super().__init__(name="serial-reader", daemon=True)
+        self.serial_port = serial_port
+        self.replies = queue.Queue()  # ok, error, alarm, reset and closed, for the streamer
+        self.events = events  # Everything but ok, for the UI
+        self.last_heard = time.monotonic()  # When the controller last sent a line of any kind
+
+    def run(self):
+        try:
+            while True:
+                raw = self.serial_port.readline()  # Returns b"" on the port's read timeout
+                if not raw:
+                    continue
+                self.last_heard = time.monotonic()
+                reply = classify(raw.decode(errors="replace").strip())
+                if not reply.text:
+                    continue
+                if reply.kind in ("ok", "error", "alarm", "reset"):
+                    self.replies.put(reply)
+                if reply.kind != "ok":
+                    self.events.put(reply)
+        except Exception as e:
+            # The port was closed or unplugged
+            closed = Reply("closed", str(e), None, None)
+            self.replies.put(closed)
+            self.events.put(closed)
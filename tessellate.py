@@ -0,0 +1,40 @@
+import math
+from functools import lru_cache
+
+# Turns arcs and circles into line segments whose chord error stays within a
+# tolerance (mm), so tight curves get many segments and gentle ones few,
+# whatever their size. Shapes are flattened around the origin and cached per
+# shape parameters, then moved into place. Used by the export path for
+# controllers without G2/G3 (laser_cli.py --no-arcs).
+
+
+def arc_segment_count(r, sweep, tolerance):
+    # Fewest chords for an arc of radius r spanning `sweep` radians with
+    # sagitta (chord error) at most `tolerance`
+    if r <= tolerance:
+        return max(1, math.ceil(abs(sweep) / (2 * math.pi / 3)))
+    step = 2 * math.acos(1 - tolerance / r)
+    return max(1, math.ceil(abs(sweep) / step))
+
+
+@lru_cache(maxsize=1024)
+def _arc_offsets(r, start_angle, sweep, tolerance):
+    n = arc_segment_count(r, sweep, tolerance)
+    return tuple((r * math.cos(start_angle + sweep * k / n), r * math.sin(start_angle + sweep * k / n))
+                 for k in range(n + 1))
+
+
+def _key(value):
+    # Cache key rounding, so tiny float noise still hits the cache
+    return round(value, 9)
+
+
+def tessellate_arc(cx, cy, r, start_angle, sweep, tolerance=0.01):
+    # Points along an arc from start_angle (radians, counter-clockwise positive)
+    offsets = _arc_offsets(_key(r), _key(start_angle), _key(sweep), tolerance)
+    return [(cx + dx, cy + dy) for dx, dy in offsets]
+
+
+def tessellate_circle(cx, cy, r, tolerance=0.01, clockwise=True):
+    # Closed polyline starting and ending at the rightmost point
+    return tessellate_arc(cx, cy, r, 0.0, -2 * math.pi if clockwise else 2 * math.pi, tolerance)